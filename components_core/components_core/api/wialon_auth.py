@@ -1,31 +1,45 @@
 import frappe
-import requests
-import json
-from frappe.utils import now_datetime, get_datetime
-from datetime import timedelta
-
-WIALON_API_URL = "https://hst-api.wialon.com/wialon/ajax.html"
-
-def get_wialon_credentials():
-    """Fetch API token from Frappe Configuration DocType."""
-    config = frappe.get_single("Wialon API Configuration")
-    return config.api_token if config else None
+import time
+from frappe.utils import now_datetime
+from redis.exceptions import LockError
+from components_core.api.wialon_client import get_client, WialonAPIError
+from components_core.api.wialon_config import DEFAULT_ACCOUNT, clear_config_cache, get_account, get_config, parse_resource_ids
+from components_core.api.wialon_limiter import get_guard
+
+# Session broker: each account's current session lives in Redis so every
+# worker shares it, with a short-lived process-local copy so hot paths never
+# leave the process.
+SESSION_CACHE_KEY = "wialon_session"
+SESSION_LOCK_KEY = "wialon_session_refresh_lock"
+SESSION_TTL = 3600  # Sessions are treated as expired after 1 hour
+SESSION_REFRESH_AFTER = 3000  # Refresh in the background after 50 minutes
+SESSION_LOCAL_TTL = 30  # How long a process trusts its local copy
+SESSION_LOCK_TIMEOUT = 30
+SESSION_WAIT_TIMEOUT = 15
+
+_local_sessions = {}  # (site, account) -> local copy
+
+def get_wialon_credentials(account=None):
+    """Return an account's API token."""
+    account = get_account(account)
+    return account["api_token"] if account else None
 
 def validate_session(session_id):
     """Check if the session is still valid."""
     try:
-        response = requests.get(
-            WIALON_API_URL,
-            params={"svc": "core/check_session", "sid": session_id},
-            timeout=5
-        )
-        return response.json().get("error", 1) == 0
-    except Exception as e:
+        get_client().call("core/check_session", sid=session_id)
+        return True
+    except WialonAPIError as e:
         frappe.log_error(f"Session validation failed: {str(e)}")
         return False
 
 def fetch_resource_id(session_id):
     """Fetch Resource ID after successful authentication."""
+    resource_ids = fetch_resource_ids(session_id, limit=1)
+    return resource_ids[0] if resource_ids else None
+
+def fetch_resource_ids(session_id, limit=None):
+    """Fetch the IDs of the resources a session can see, at most ``limit`` of them."""
     params = {
         "spec": {
             "itemsType": "avl_resource",
@@ -37,86 +51,230 @@ def fetch_resource_id(session_id):
         "force": 1,
         "flags": 1,
         "from": 0,
-        "to": 1
+        "to": limit or 0
     }
 
     try:
-        response = requests.post(
-            f"{WIALON_API_URL}?svc=core/search_items&sid={session_id}",
-            data={"params": json.dumps(params)},
-            timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
-
-        if "items" in data and len(data["items"]) > 0:
-            return data["items"][0]["id"]
-
-    except requests.exceptions.RequestException as e:
+        data = get_client().call("core/search_items", params, sid=session_id)
+        return [item["id"] for item in data.get("items", [])]
+
+    except WialonAPIError as e:
         frappe.log_error(f"Failed fetching resource ID: {str(e)}")
 
-    return None
+    return []
 
 @frappe.whitelist() 
-def authenticate():
-    """Authenticate with Wialon, store session and fetch Resource ID."""
-    config = frappe.get_single("Wialon API Configuration")
+def authenticate(account=None):
+    """Authenticate an account with Wialon, store its session and fetch its Resource IDs."""
+    account = account or DEFAULT_ACCOUNT
+    credentials = get_account(account)
 
-    if not config.api_token:
+    if not credentials:
         return {"error": "API Token not configured in 'Wialon API Configuration'"}
 
     try:
-        response = requests.get(
-            WIALON_API_URL,
-            params={
-                "svc": "token/login",
-                "params": json.dumps({"token": config.api_token})
-            },
-            timeout=10
-        )
-        response.raise_for_status()
-
-        auth_data = response.json()
+        auth_data = get_client().call("token/login", {"token": credentials["api_token"]}, guard=get_guard(account))
         if "eid" in auth_data:
             session_id = auth_data["eid"]
-            resource_id = fetch_resource_id(session_id)
-
-            # Use a transaction-free update to avoid locks
-            frappe.db.set_value("Wialon API Configuration", None, {
+            # Resources rarely change; only look them up when none are configured.
+            # The default account keeps to the first one, which is saved on the Single
+            resource_ids = credentials["resource_ids"] or [
+                str(resource_id)
+                for resource_id in fetch_resource_ids(session_id, limit=1 if account == DEFAULT_ACCOUNT else None)
+            ]
+            resource_id = resource_ids[0] if resource_ids else None
+
+            _store_session({
                 "session_id": session_id,
-                "last_authenticated": datetime.now(),
-                "resource_id": resource_id
-            })
-            frappe.db.commit()  # ✅ Fix: Force commit transaction
+                "resource_id": resource_id,
+                "resource_ids": resource_ids,
+                "authenticated_at": time.time()
+            }, account)
+
+            # The Single only records the default account's session
+            if account == DEFAULT_ACCOUNT:
+                # Use a transaction-free update to avoid locks
+                frappe.db.set_value("Wialon API Configuration", None, {
+                    "session_id": session_id,
+                    "last_authenticated": now_datetime(),
+                    "resource_id": get_config().resource_id or resource_id
+                })
+                frappe.db.commit()  # ✅ Fix: Force commit transaction
+                clear_config_cache()  # set_value skips the doc_events that would clear it
 
             return {
                 "success": True,
                 "session_id": session_id,
-                "resource_id": resource_id
+                "resource_id": resource_id,
+                "resource_ids": resource_ids
             }
 
         return {"error": "Authentication failed: Invalid response"}
 
-    except requests.exceptions.RequestException as e:
+    except WialonAPIError as e:
         frappe.log_error(f"Wialon Auth Error: {str(e)}")
         return {"error": f"Connection error: {str(e)}"}
 
 @frappe.whitelist()
-def get_valid_session():
-    """Ensure session is valid before making Wialon API requests"""
-    config = frappe.get_single("Wialon API Configuration")
-
-    # If session ID exists and is not expired, return it
-    if config.session_id and config.last_authenticated:
-        if isinstance(config.last_authenticated, str):
-            config.last_authenticated = datetime.fromisoformat(config.last_authenticated)
-
-        session_age = (datetime.now() - config.last_authenticated).total_seconds()
-        if session_age < 3600:  # Valid for 1 hour
-            return {"session_id": config.session_id, "resource_id": config.resource_id}
+def get_valid_session(account=None):
+    """Ensure an account's session is valid before making Wialon API requests.
+
+    Served from the session broker. Sessions close to expiry are refreshed by a
+    background job while callers keep using the current one; an expired or
+    missing session is refreshed by a single worker while the others wait.
+    """
+    account = account or DEFAULT_ACCOUNT
+    session = _read_session(account=account)
+
+    if session:
+        session_age = time.time() - session["authenticated_at"]
+        if session_age < SESSION_TTL:
+            if session_age >= SESSION_REFRESH_AFTER:
+                _schedule_refresh(account)
+            return _session_info(session)
+
+    return _refresh_single_flight(account=account)
+
+def get_session_id(account=None):
+    """Return an account's current Wialon session ID, or None if no session could be established."""
+    return get_valid_session(account).get("session_id")
+
+def invalidate_session(session_id, account=None):
+    """Drop an account's shared session if it is still the one Wialon rejected."""
+    account = account or DEFAULT_ACCOUNT
+    session = _read_session(use_local=False, account=account)
+    if session and session["session_id"] == session_id:
+        frappe.cache().delete_value(_session_key(account))
+    _local_sessions.pop((frappe.local.site, account), None)
+
+def refresh_session(doc, method=None):
+    """Wialon API Configuration on_update: drop the cached settings and re-authenticate changed accounts.
+
+    Accounts whose token or resources changed drop their session and log in
+    again in background jobs once the change is committed. Sessions of
+    removed or disabled accounts are dropped; the others are kept.
+    """
+    clear_config_cache()
+    before = _get_doc_account_settings(doc.get_doc_before_save())
+    after = _get_doc_account_settings(doc)
+
+    for account in before.keys() - after.keys():
+        _clear_shared_session(account)
+    for account, settings in after.items():
+        if before.get(account) != settings:
+            _clear_shared_session(account)
+            _schedule_refresh(account, enqueue_after_commit=True)
+
+def clear_session(doc, method=None):
+    """Wialon API Configuration on_trash: drop the cached settings and sessions."""
+    clear_config_cache()
+    for account in _get_doc_accounts(doc):
+        _clear_shared_session(account)
+
+def refresh_session_in_background(account=None):
+    """Background job: refresh a session ahead of expiry unless another worker already did."""
+    _refresh_single_flight(max_age=SESSION_REFRESH_AFTER, account=account or DEFAULT_ACCOUNT)
+
+def _session_key(account):
+    # The default account keeps the original key so existing sessions stay valid
+    return SESSION_CACHE_KEY if account == DEFAULT_ACCOUNT else f"{SESSION_CACHE_KEY}|{account}"
+
+def _session_info(session):
+    return {
+        "session_id": session["session_id"],
+        "resource_id": session["resource_id"],
+        "resource_ids": session.get("resource_ids") or ([session["resource_id"]] if session["resource_id"] else [])
+    }
 
-    # Otherwise, authenticate and return new session
-    return authenticate()
+def _get_doc_accounts(doc):
+    return [DEFAULT_ACCOUNT] + [row.name for row in doc.get("accounts") or []]
+
+def _get_doc_account_settings(doc):
+    # Enabled accounts with a token -> (token, resource IDs), as get_config() builds them
+    if doc is None:
+        return {}
+
+    settings = {}
+    if doc.get("api_token"):
+        settings[DEFAULT_ACCOUNT] = (doc.get("api_token"), parse_resource_ids(doc.get("resource_id")))
+    for row in doc.get("accounts") or []:
+        if row.get("enabled") and row.get("api_token"):
+            settings[row.name] = (row.get("api_token"), parse_resource_ids(row.get("resource_ids")))
+    return settings
+
+def _clear_shared_session(account):
+    frappe.cache().delete_value(_session_key(account))
+    _local_sessions.pop((frappe.local.site, account), None)
+
+def _read_session(use_local=True, account=DEFAULT_ACCOUNT):
+    """Read an account's shared session, preferring the process-local copy."""
+    local_key = (frappe.local.site, account)
+
+    if use_local:
+        local = _local_sessions.get(local_key)
+        if local and time.time() < local["expires_at"]:
+            return local["session"]
+
+    session = frappe.cache().get_value(_session_key(account), expires=True)
+    if session:
+        _local_sessions[local_key] = {"session": session, "expires_at": time.time() + SESSION_LOCAL_TTL}
+    return session
+
+def _store_session(session, account=DEFAULT_ACCOUNT):
+    """Publish a freshly authenticated session to Redis and the local process."""
+    frappe.cache().set_value(_session_key(account), session, expires_in_sec=SESSION_TTL)
+    _local_sessions[(frappe.local.site, account)] = {"session": session, "expires_at": time.time() + SESSION_LOCAL_TTL}
+
+def _schedule_refresh(account=DEFAULT_ACCOUNT, enqueue_after_commit=False):
+    """Queue an early refresh; deduplicated so only one job per account is ever pending."""
+    frappe.enqueue(
+        "components_core.api.wialon_auth.refresh_session_in_background",
+        queue="short",
+        job_id="wialon_session_refresh" if account == DEFAULT_ACCOUNT else f"wialon_session_refresh_{account}",
+        deduplicate=True,
+        enqueue_after_commit=enqueue_after_commit,
+        account=account
+    )
+
+def _refresh_single_flight(max_age=SESSION_TTL, account=DEFAULT_ACCOUNT):
+    """Re-authenticate behind a distributed lock so only one worker calls token/login for an account.
+
+    Workers that lose the race wait for the winner to publish the new session
+    instead of authenticating themselves, and stop waiting as soon as the
+    winner releases the lock without one.
+    """
+    cache = frappe.cache()
+    lock_key = SESSION_LOCK_KEY if account == DEFAULT_ACCOUNT else f"{SESSION_LOCK_KEY}|{account}"
+    lock = cache.lock(cache.make_key(lock_key), timeout=SESSION_LOCK_TIMEOUT)
+
+    if lock.acquire(blocking=False):
+        try:
+            # Another worker may have refreshed between our read and the lock
+            session = _read_session(use_local=False, account=account)
+            if session and time.time() - session["authenticated_at"] < max_age:
+                return _session_info(session)
+            return authenticate(account)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                pass
+
+    deadline = time.monotonic() + SESSION_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        # Check the lock before the session: the winner stores it before unlocking
+        released = not lock.locked()
+        session = _read_session(use_local=False, account=account)
+        if session and time.time() - session["authenticated_at"] < max_age:
+            return _session_info(session)
+        if released:
+            # The winner gave up without a session (e.g. token/login failed);
+            # waiting longer would only pile requests up behind it
+            return {"error": "Wialon session refresh failed"}
+
+    frappe.log_error("Timed out waiting for Wialon session refresh", "Wialon Auth")
+    return {"error": "Timed out waiting for Wialon session refresh"}
 
 
 
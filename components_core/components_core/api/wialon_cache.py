@@ -0,0 +1,133 @@
+import frappe
+import math
+import random
+import time
+
+CACHE_STATS_KEY = "wialon_cache_stats"
+CACHE_STALE_TTL = 600  # How long an expired value may still be served while refreshing
+CACHE_LOCK_TIMEOUT = 30
+CACHE_WAIT_TIMEOUT = 10
+EARLY_EXPIRY_BETA = 1.0  # >1 refreshes earlier, <1 later
+
+def get_or_refresh(key, ttl, generator, stale_ttl=CACHE_STALE_TTL):
+    """Read a cached value with stale-while-revalidate semantics.
+
+    Values expire after ``ttl`` seconds but stay in Redis for ``stale_ttl``
+    more. Once a value is due, exactly one caller (holding a Redis lock)
+    regenerates it while everyone else keeps getting the stale copy. Due-ness
+    is probabilistic (XFetch): the closer a value is to expiry and the slower
+    it was to compute, the more likely a caller refreshes it early, which
+    spreads refreshes out instead of having them all land at once.
+
+    If ``generator`` raises and a stale value exists, the stale value is
+    served instead of the error.
+    """
+    cache = frappe.cache()
+    entry = cache.get_value(key, expires=True)
+
+    if entry:
+        if not _is_due(entry):
+            record_cache_event(key, "hit")
+            return entry["value"]
+
+        lock_token = _acquire_refresh_lock(key)
+        if not lock_token:
+            record_cache_event(key, "stale")
+            return entry["value"]
+    else:
+        lock_token = _acquire_refresh_lock(key)
+        if not lock_token:
+            # Cold miss while another worker computes: wait for its result
+            entry = _wait_for_value(key)
+            if entry:
+                record_cache_event(key, "hit")
+                return entry["value"]
+
+    record_cache_event(key, "miss")
+    try:
+        started = time.monotonic()
+        value = generator()
+        compute_time = time.monotonic() - started
+    except Exception:
+        _release_refresh_lock(key, lock_token)
+        if entry:
+            record_cache_event(key, "stale_on_error")
+            return entry["value"]
+        raise
+
+    # Store before unlocking, or the next lock holder would still see the old entry
+    try:
+        cache.set_value(key, {
+            "value": value,
+            "expires_at": time.time() + ttl,
+            "compute_time": compute_time
+        }, expires_in_sec=ttl + stale_ttl)
+    finally:
+        _release_refresh_lock(key, lock_token)
+
+    return value
+
+def get_stale_value(key):
+    """Return the cached value for ``key`` even if it has expired, or None."""
+    entry = frappe.cache().get_value(key, expires=True)
+    return entry["value"] if entry else None
+
+def record_cache_event(key, outcome):
+    """Count a cache outcome (hit, miss, stale, stale_on_error) for ``key``."""
+    cache = frappe.cache()
+    cache.hincrby(cache.make_key(CACHE_STATS_KEY), f"{key}|{outcome}", 1)
+
+@frappe.whitelist()
+def get_cache_stats():
+    """Return hit/miss counters per cache key."""
+    frappe.only_for("System Manager")
+
+    # Counters are plain integers, so read them raw rather than through the
+    # unpickling RedisWrapper.hgetall
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    pipe.hgetall(cache.make_key(CACHE_STATS_KEY))
+    stats = {}
+    for field, count in pipe.execute()[0].items():
+        key, outcome = field.decode().rsplit("|", 1)
+        stats.setdefault(key, {})[outcome] = int(count)
+
+    for counters in stats.values():
+        lookups = counters.get("hit", 0) + counters.get("stale", 0) + counters.get("miss", 0)
+        counters["hit_ratio"] = round((lookups - counters.get("miss", 0)) / lookups, 4) if lookups else None
+
+    return stats
+
+def _is_due(entry):
+    # XFetch: -log(U) is exponentially distributed, so early refreshes are rare
+    # until the remaining lifetime approaches the recompute time
+    early = entry["compute_time"] * EARLY_EXPIRY_BETA * -math.log(1 - random.random())
+    return time.time() + early >= entry["expires_at"]
+
+def _acquire_refresh_lock(key):
+    cache = frappe.cache()
+    token = frappe.generate_hash(length=12)
+    if cache.set(cache.make_key(f"{key}|lock"), token, nx=True, ex=CACHE_LOCK_TIMEOUT):
+        return token
+    return None
+
+def _release_refresh_lock(key, token):
+    if not token:
+        return
+
+    cache = frappe.cache()
+    lock_key = cache.make_key(f"{key}|lock")
+    if cache.get(lock_key) == token.encode():
+        cache.delete(lock_key)
+
+def _wait_for_value(key):
+    cache = frappe.cache()
+    deadline = time.monotonic() + CACHE_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get_value(key, expires=True)
+        if entry:
+            return entry
+        if cache.get(cache.make_key(f"{key}|lock")) is None:
+            break
+    return None
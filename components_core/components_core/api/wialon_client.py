@@ -0,0 +1,514 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as URLLibError
+
+try:
+    import ijson
+except ImportError:  # Optional: without it streamed responses are decoded in one go
+    ijson = None
+
+WIALON_API_URL = "https://hst-api.wialon.com/wialon/ajax.html"
+API_URL_CONFIG = "wialon_api_url"  # Site config key, e.g. to point a test site at the simulator
+API_URL_ENV = "WIALON_API_URL"  # Used outside a site context, e.g. by benchmarks
+
+CONNECT_TIMEOUT = 5
+DEFAULT_TIMEOUT = 10
+
+# Read timeouts per service (seconds); services not listed use DEFAULT_TIMEOUT
+SERVICE_TIMEOUTS = {
+    "core/check_session": 5,
+    "token/login": 10,
+    "core/search_items": 30,
+    "events/get": 30,
+    "resource/get_notification_data": 15,
+    "avl_evts": 30,
+}
+
+POOL_SIZE = 20
+MAX_BATCH_SIZE = 50
+PAGE_SIZE = 500
+PAGE_WORKERS = 4
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 8
+RETRY_HTTP_STATUSES = {429, 500, 502, 503, 504}
+
+# Wialon error codes (https://sdk.wialon.com/wiki/en/sidebar/remoteapi/apiref/errors/errors)
+INVALID_SESSION = 1
+RETRY_WIALON_ERRORS = {5, 9, 1003}
+WIALON_ERRORS = {
+    1: "Invalid session",
+    2: "Invalid service name",
+    3: "Invalid result",
+    4: "Invalid input",
+    5: "Error performing request",
+    6: "Unknown error",
+    7: "Access denied",
+    8: "Invalid user name or password",
+    9: "Authorization server is unavailable",
+    1001: "No messages for selected interval",
+    1002: "Item with such unique property already exists",
+    1003: "Only one request is allowed at the moment",
+    1004: "Limit of messages has been exceeded",
+    1005: "Execution time has exceeded the limit",
+}
+
+_clients = {}  # base URL -> client
+_client_lock = threading.Lock()
+
+
+class WialonAPIError(Exception):
+    """Raised for transport failures and Wialon error responses alike."""
+
+    def __init__(self, message, code=None, svc=None):
+        super().__init__(message)
+        self.code = code
+        self.svc = svc
+
+
+class WialonCircuitOpenError(WialonAPIError):
+    """Raised without calling Wialon while the circuit breaker is open."""
+
+
+class WialonRateLimitError(WialonAPIError):
+    """Raised when no rate limiter token frees up within the caller's wait."""
+
+
+def get_client(base_url=None):
+    """Return the process-wide Wialon client for an API URL, creating it on first use.
+
+    ``base_url`` defaults to the site's wialon_api_url, then the
+    WIALON_API_URL environment variable, then the public Wialon API.
+    """
+    base_url = base_url or get_api_url()
+    client = _clients.get(base_url)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(base_url)
+            if client is None:
+                client = _clients[base_url] = WialonClient(base_url)
+    return client
+
+
+def get_api_url():
+    """Return the Wialon API URL configured for the current site or process."""
+    try:
+        import frappe
+        url = frappe.conf.get(API_URL_CONFIG)
+    except (ImportError, AttributeError, RuntimeError):
+        # No frappe, or no site bound to this thread
+        url = None
+    return url or os.environ.get(API_URL_ENV) or WIALON_API_URL
+
+
+def decode_error(svc, data):
+    """Return a WialonAPIError for an error response, or None if the call succeeded."""
+    if not isinstance(data, dict) or not data.get("error"):
+        return None
+
+    code = data["error"]
+    reason = data.get("reason") or WIALON_ERRORS.get(code, "Unknown error")
+    return WialonAPIError(f"Wialon API error {code} on {svc}: {reason}", code=code, svc=svc)
+
+
+class WialonClient:
+    """Pooled keep-alive HTTP client for the Wialon Remote API.
+
+    One instance is shared per process so TCP and TLS connections are reused
+    across calls. Transient failures are retried with jittered exponential
+    backoff; every failure surfaces as a WialonAPIError.
+
+    Calls made in a site context pass through the shared rate limiter and
+    circuit breaker (wialon_limiter). Threads without frappe.local must be
+    given a ``guard`` from get_guard() made on the job thread.
+    """
+
+    def __init__(self, base_url=WIALON_API_URL, pool_size=POOL_SIZE, max_retries=MAX_RETRIES):
+        self.base_url = base_url
+        self.events_url = urljoin(base_url, "/avl_evts")
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def call(self, svc, params=None, sid=None, timeout=None, guard=None):
+        """Call a Wialon service and return its decoded JSON response.
+
+        Args:
+            svc (str): Service name, e.g. "core/search_items".
+            params (dict, optional): Service parameters.
+            sid (str, optional): Session ID; omitted for token/login.
+            timeout (float, optional): Read timeout overriding SERVICE_TIMEOUTS.
+            guard (CallGuard, optional): Limiter to admit the call through (default: get_guard()).
+
+        Returns:
+            dict | list: Decoded response body.
+        """
+        data = {"svc": svc, "params": json.dumps(params if params is not None else {})}
+        if sid:
+            data["sid"] = sid
+
+        return self._post(self.base_url, data, svc, timeout, guard=guard)
+
+    def poll_events(self, sid, timeout=None):
+        """Fetch pending avl_evts updates for items registered with core/update_data_flags.
+
+        Returns:
+            dict: ``{"tm": <server time>, "events": [...]}``.
+        """
+        return self._post(self.events_url, {"sid": sid}, "avl_evts", timeout)
+
+    def stream_items(self, svc, params=None, prefix="items.item", sid=None, timeout=None, guard=None):
+        """Call a service and yield the records under ``prefix`` as they are parsed.
+
+        With ijson installed the response body is parsed incrementally, so
+        memory use is bounded by the largest single record rather than the
+        whole response. Without it the body is decoded at once and the same
+        records are yielded. ``prefix`` uses ijson's dotted notation, where
+        ``item`` stands for each element of an array: "items.item" yields
+        every element of the top-level "items" list.
+
+        Connection and HTTP errors are retried like call(); a Wialon error
+        in the body is raised as WialonAPIError when it is reached.
+        """
+        data = {"svc": svc, "params": json.dumps(params if params is not None else {})}
+        if sid:
+            data["sid"] = sid
+
+        response = self._post(self.base_url, data, svc, timeout, stream=True, guard=guard)
+        with response:
+            if ijson is None:
+                result = response.json()
+                error = decode_error(svc, result)
+                if error:
+                    raise error
+                yield from _select(result, prefix.split("."))
+                return
+
+            response.raw.decode_content = True
+            try:
+                events = ijson.parse(response.raw, use_float=True)
+                yield from ijson.items(_raise_wialon_errors(events, svc), prefix)
+            except ijson.JSONError as e:
+                raise WialonAPIError(f"Invalid JSON response from {svc}", code=3, svc=svc) from e
+            except (requests.exceptions.RequestException, URLLibError) as e:
+                raise WialonAPIError(f"Connection error on {svc}: {str(e)}", svc=svc) from e
+
+    def stream_items_with_session(self, svc, params=None, prefix="items.item", timeout=None, account=None):
+        """stream_items() using an account's shared broker session (default account if None).
+
+        A rejected session is renewed and the call retried once, provided
+        no records have been yielded yet.
+        """
+        from components_core.api.wialon_auth import get_session_id, invalidate_session
+        from components_core.api.wialon_limiter import get_guard
+
+        guard = get_guard(account)
+        for attempt in range(2):
+            session_id = get_session_id(account)
+            if not session_id:
+                raise WialonAPIError("Failed to establish a valid Wialon session", code=INVALID_SESSION, svc=svc)
+
+            yielded = False
+            try:
+                for record in self.stream_items(svc, params, prefix, sid=session_id, timeout=timeout, guard=guard):
+                    yielded = True
+                    yield record
+                return
+            except WialonAPIError as e:
+                if e.code != INVALID_SESSION or yielded or attempt:
+                    raise
+
+            invalidate_session(session_id, account)
+
+    def _post(self, url, data, svc, timeout=None, stream=False, guard=None):
+        """POST a request, retrying transient failures and decoding Wialon errors.
+
+        With ``stream`` the response is returned undecoded once its status is
+        known to be good; the caller reads and closes it.
+
+        The call takes one rate limiter token, retries included. Failures
+        that outlast the retries count towards opening the circuit.
+        """
+        if guard is None:
+            guard = _get_default_guard()
+        if guard is None:
+            return self._send(url, data, svc, timeout, stream)
+
+        probe = guard.admit(svc)
+        try:
+            result = self._send(url, data, svc, timeout, stream)
+        except WialonAPIError as e:
+            if e.code is None or e.code in RETRY_WIALON_ERRORS:
+                guard.record_failure(probe, svc)
+            elif probe:
+                # Wialon answered, so it is up again even if the call itself failed
+                guard.record_success(probe)
+            raise
+
+        guard.record_success(probe)
+        return result
+
+    def _send(self, url, data, svc, timeout=None, stream=False):
+        read_timeout = timeout or SERVICE_TIMEOUTS.get(svc, DEFAULT_TIMEOUT)
+
+        for attempt in range(self.max_retries + 1):
+            retry = attempt < self.max_retries
+
+            try:
+                response = self.session.post(url, data=data, timeout=(CONNECT_TIMEOUT, read_timeout), stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if retry:
+                    self._backoff(attempt)
+                    continue
+                raise WialonAPIError(f"Connection error on {svc}: {str(e)}", svc=svc) from e
+            except requests.exceptions.RequestException as e:
+                raise WialonAPIError(f"Request error on {svc}: {str(e)}", svc=svc) from e
+
+            if response.status_code >= 400:
+                response.close()
+                if retry and response.status_code in RETRY_HTTP_STATUSES:
+                    self._backoff(attempt)
+                    continue
+                raise WialonAPIError(f"HTTP {response.status_code} on {svc}", svc=svc)
+
+            if stream:
+                return response
+
+            try:
+                result = response.json()
+            except ValueError as e:
+                raise WialonAPIError(f"Invalid JSON response from {svc}", code=3, svc=svc) from e
+
+            error = decode_error(svc, result)
+            if error is None:
+                return result
+            if retry and error.code in RETRY_WIALON_ERRORS:
+                self._backoff(attempt)
+                continue
+            raise error
+
+    def call_with_session(self, svc, params=None, timeout=None, account=None):
+        """Call a service using an account's shared broker session (default account if None).
+
+        If Wialon rejects the session it is invalidated and the call is retried
+        once with a freshly authenticated one.
+        """
+        from components_core.api.wialon_auth import get_session_id, invalidate_session
+        from components_core.api.wialon_limiter import get_guard
+
+        guard = get_guard(account)
+        session_id = get_session_id(account)
+        if not session_id:
+            raise WialonAPIError("Failed to establish a valid Wialon session", code=INVALID_SESSION, svc=svc)
+
+        try:
+            return self.call(svc, params, sid=session_id, timeout=timeout, guard=guard)
+        except WialonAPIError as e:
+            if e.code != INVALID_SESSION:
+                raise
+
+        invalidate_session(session_id, account)
+        session_id = get_session_id(account)
+        if not session_id:
+            raise WialonAPIError("Failed to establish a valid Wialon session", code=INVALID_SESSION, svc=svc)
+        return self.call(svc, params, sid=session_id, timeout=timeout, guard=guard)
+
+    def iter_items(self, spec, flags, page_size=PAGE_SIZE, max_workers=PAGE_WORKERS, account=None):
+        """Yield every item matching a core/search_items spec, fetching pages concurrently.
+
+        The first page is fetched with force=1, which makes Wialon build and
+        keep the search result for the session; the remaining pages are read
+        from that result by up to max_workers threads. Items are yielded page
+        by page as pages arrive, so pages may come out of order and at most
+        max_workers pages are held in memory at once.
+        """
+        from components_core.api.wialon_auth import get_session_id
+        from components_core.api.wialon_limiter import get_guard
+
+        params = {"spec": spec, "force": 1, "flags": flags, "from": 0, "to": page_size - 1}
+        first_page = self.call_with_session("core/search_items", params, account=account)
+        total = first_page.get("totalItemsCount", 0)
+
+        yield from first_page.get("items", [])
+        if total <= page_size:
+            return
+
+        session_id = get_session_id(account)
+        guard = get_guard(account)  # Pages are fetched on threads without frappe.local
+        page_starts = iter(range(page_size, total, page_size))
+
+        def fetch_page(start):
+            page_params = {
+                "spec": spec,
+                "force": 0,
+                "flags": flags,
+                "from": start,
+                "to": min(start + page_size, total) - 1
+            }
+            return self.call("core/search_items", page_params, sid=session_id, guard=guard)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wialon-page")
+        try:
+            in_flight = {executor.submit(fetch_page, start) for start in islice(page_starts, max_workers)}
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = future.result()
+                    in_flight.update(executor.submit(fetch_page, start) for start in islice(page_starts, 1))
+                    yield from page.get("items", [])
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def batch(self, account=None):
+        """Return a WialonBatch that sends queued calls through this client with an account's session."""
+        return WialonBatch(self, account)
+
+    def _backoff(self, attempt):
+        """Sleep with full jitter so concurrent callers do not retry in lockstep."""
+        time.sleep(random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt)))
+
+
+def _get_default_guard():
+    try:
+        from components_core.api.wialon_limiter import get_guard
+    except ImportError:
+        # Used without frappe, e.g. against the simulator
+        return None
+    return get_guard()
+
+
+def _select(value, path):
+    """Yield the values at an ijson-style dotted path from an already decoded document."""
+    if not path or path == [""]:
+        yield value
+        return
+
+    key, rest = path[0], path[1:]
+    if key == "item":
+        for element in value if isinstance(value, list) else []:
+            yield from _select(element, rest)
+    elif isinstance(value, dict) and key in value:
+        yield from _select(value[key], rest)
+
+
+def _raise_wialon_errors(events, svc):
+    """Pass ijson parse events through, raising on a top-level Wialon error code."""
+    for prefix, event, value in events:
+        if prefix == "error" and event == "number" and value:
+            raise decode_error(svc, {"error": int(value)})
+        yield prefix, event, value
+
+
+class BatchResult:
+    """Deferred result of one call queued on a WialonBatch."""
+
+    def __init__(self, svc, params):
+        self.svc = svc
+        self.params = params
+        self.done = False
+        self._value = None
+        self._error = None
+
+    def result(self):
+        """Return the decoded response, raising WialonAPIError if this call failed."""
+        if not self.done:
+            raise RuntimeError(f"Batch containing {self.svc} has not been executed")
+        if self._error:
+            raise self._error
+        return self._value
+
+    def _resolve(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self.done = True
+
+
+class WialonBatch:
+    """Coalesce independent Wialon calls into core/batch round trips.
+
+    Calls are queued with add() and sent together when the batch is executed,
+    either explicitly or on leaving a ``with`` block. Each call gets its own
+    BatchResult, so a failure inside the batch only affects the call that
+    caused it.
+
+        with get_client().batch() as batch:
+            events = batch.add("events/get", event_params)
+            units = batch.add("core/search_items", unit_params)
+        events.result()
+    """
+
+    def __init__(self, client, account=None):
+        self.client = client
+        self.account = account
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
+
+    def add(self, svc, params=None):
+        """Queue a call and return its BatchResult."""
+        result = BatchResult(svc, params if params is not None else {})
+        self.pending.append(result)
+        return result
+
+    def execute(self):
+        """Send all queued calls, at most MAX_BATCH_SIZE per core/batch request."""
+        pending, self.pending = self.pending, []
+
+        for start in range(0, len(pending), MAX_BATCH_SIZE):
+            chunk = pending[start:start + MAX_BATCH_SIZE]
+
+            # A batch of one gains nothing over a plain call
+            if len(chunk) == 1:
+                self._execute_single(chunk[0])
+            else:
+                self._execute_chunk(chunk)
+
+    def _execute_single(self, item):
+        try:
+            item._resolve(value=self.client.call_with_session(item.svc, item.params, account=self.account))
+        except WialonAPIError as e:
+            item._resolve(error=e)
+
+    def _execute_chunk(self, chunk):
+        params = {
+            "params": [{"svc": item.svc, "params": item.params} for item in chunk],
+            "flags": 0
+        }
+        timeout = max(SERVICE_TIMEOUTS.get(item.svc, DEFAULT_TIMEOUT) for item in chunk)
+
+        try:
+            responses = self.client.call_with_session("core/batch", params, timeout=timeout, account=self.account)
+        except WialonAPIError as e:
+            for item in chunk:
+                item._resolve(error=e)
+            return
+
+        if not isinstance(responses, list) or len(responses) != len(chunk):
+            error = WialonAPIError("Malformed core/batch response", code=3, svc="core/batch")
+            for item in chunk:
+                item._resolve(error=error)
+            return
+
+        for item, response in zip(chunk, responses):
+            error = decode_error(item.svc, response)
+            if error:
+                item._resolve(error=error)
+            else:
+                item._resolve(value=response)
@@ -0,0 +1,89 @@
+import frappe
+import time
+
+# Cached Wialon API Configuration: one Redis copy shared by all workers and a
+# short-lived process-local copy, so hot paths read the settings without a
+# database query. Saving or deleting the document clears both (see the
+# doc_events in hooks.py); other processes pick the change up within
+# CONFIG_LOCAL_TTL.
+CONFIG_DOCTYPE = "Wialon API Configuration"
+ACCOUNT_DOCTYPE = "Wialon API Account"
+CONFIG_CACHE_KEY = "wialon_api_configuration"
+CONFIG_FIELDS = ("api_token", "resource_id")
+CONFIG_TTL = 86400
+CONFIG_LOCAL_TTL = 30
+
+# The token and resource on the Single itself form the default account; rows
+# in its Accounts table are further accounts, keyed by row name
+DEFAULT_ACCOUNT = "default"
+
+_local_configs = {}
+
+def get_config():
+    """Return the Wialon settings as a dict of CONFIG_FIELDS plus ``accounts``, from cache where possible.
+
+    ``accounts`` maps each enabled account to its ``api_token`` and
+    ``resource_ids`` (empty for every resource the token can see).
+    """
+    site = frappe.local.site
+
+    local = _local_configs.get(site)
+    if local and time.time() < local["expires_at"]:
+        return local["config"]
+
+    cache = frappe.cache()
+    config = cache.get_value(CONFIG_CACHE_KEY, expires=True)
+    if config is None:
+        values = frappe.db.get_singles_dict(CONFIG_DOCTYPE)
+        config = frappe._dict({field: values.get(field) for field in CONFIG_FIELDS})
+        config.accounts = _load_accounts(config)
+        cache.set_value(CONFIG_CACHE_KEY, config, expires_in_sec=CONFIG_TTL)
+
+    _local_configs[site] = {"config": config, "expires_at": time.time() + CONFIG_LOCAL_TTL}
+    return config
+
+def get_accounts():
+    """Return the names of all enabled accounts, the default account first if it has a token."""
+    return list(get_config().accounts)
+
+def get_account(account=None):
+    """Return an account's ``api_token`` and ``resource_ids``, or None if it is not configured."""
+    return get_config().accounts.get(account or DEFAULT_ACCOUNT)
+
+def parse_resource_ids(value):
+    """Split a comma- or newline-separated list of resource IDs."""
+    return [resource_id.strip() for resource_id in (value or "").replace("\n", ",").split(",") if resource_id.strip()]
+
+def clear_config_cache():
+    """Drop the cached settings so the next get_config() reads them from the database.
+
+    Also clears them again once the current transaction commits, so a worker
+    that re-cached the old values in between does not keep them.
+    """
+    _clear_config_cache()
+    frappe.db.after_commit.add(_clear_config_cache)
+
+def _clear_config_cache():
+    frappe.cache().delete_value(CONFIG_CACHE_KEY)
+    _local_configs.pop(frappe.local.site, None)
+
+def _load_accounts(config):
+    accounts = {}
+    if config.api_token:
+        accounts[DEFAULT_ACCOUNT] = {
+            "api_token": config.api_token,
+            "resource_ids": parse_resource_ids(config.resource_id)
+        }
+
+    rows = frappe.get_all(
+        ACCOUNT_DOCTYPE,
+        filters={"parent": CONFIG_DOCTYPE, "parenttype": CONFIG_DOCTYPE, "enabled": 1},
+        fields=["name", "api_token", "resource_ids"],
+        order_by="idx",
+        parent_doctype=CONFIG_DOCTYPE
+    )
+    for row in rows:
+        if row.api_token:
+            accounts[row.name] = {"api_token": row.api_token, "resource_ids": parse_resource_ids(row.resource_ids)}
+
+    return accounts
@@ -0,0 +1,97 @@
+import frappe
+import logging
+import time
+from components_core.api.wialon_auth import get_valid_session, invalidate_session
+from components_core.api.wialon_client import get_client, WialonAPIError, INVALID_SESSION
+from components_core.api.wialon_fleet import (
+    apply_position_updates,
+    format_position,
+    replace_fleet_state,
+    touch_fleet_state
+)
+from components_core.api.wialon_lock import run_lock
+from components_core.api.wialon_log import get_logger
+
+POLL_DURATION = 55  # One poller job per minute, each polling for just under a minute
+POLL_INTERVAL = 1
+REGISTERED_SESSION_KEY = "wialon_fleet_registered_session"
+UNIT_DATA_FLAGS = 1025  # Basic properties + last message and position
+
+positions_log = get_logger("positions")
+
+def register_units(session_id, resource_id=None):
+    """Subscribe the session to position updates for all units and seed the fleet state.
+
+    core/update_data_flags returns the current state of every unit it
+    registers, so the fleet state is rebuilt from that response.
+    """
+    items = get_client().call("core/update_data_flags", {
+        "spec": [{"type": "type", "data": "avl_unit", "flags": UNIT_DATA_FLAGS, "mode": 0}]
+    }, sid=session_id)
+
+    positions = [
+        format_position(item["d"]["id"], item["d"].get("nm"), item["d"]["pos"])
+        for item in items
+        if item.get("d") and item["d"].get("pos")
+    ]
+    replace_fleet_state(positions, resource_id=resource_id)
+    frappe.cache().set_value(REGISTERED_SESSION_KEY, session_id)
+    positions_log.summary("units_registered", count=len(positions))
+
+    return positions
+
+def collect_position_updates(events):
+    """Reduce an avl_evts batch to the latest position per unit.
+
+    Both new messages ("m") and item property updates ("u") may carry a
+    position; later events for the same unit win.
+    """
+    updates = {}
+    for event in events:
+        data = event.get("d") or {}
+        if event.get("t") not in ("m", "u") or not data.get("pos"):
+            continue
+
+        update = {"pos": data["pos"]}
+        if data.get("nm"):
+            update["nm"] = data["nm"]
+        updates[event["i"]] = update
+
+    return updates
+
+@run_lock("wialon_position_poller")
+def poll_positions(duration=POLL_DURATION):
+    """Background job: keep the fleet state current by polling avl_evts.
+
+    Runs for about a minute; the scheduler starts the next poller as this one
+    finishes. Units are registered once per session and only position deltas
+    are written (and pushed to realtime subscribers) afterwards.
+    """
+    deadline = time.monotonic() + duration
+    client = get_client()
+
+    while time.monotonic() < deadline:
+        session = get_valid_session()
+        session_id, resource_id = session.get("session_id"), session.get("resource_id")
+        if not session_id:
+            frappe.log_error("No Wialon session available for the position poller", "Wialon Position Poller")
+            return
+
+        try:
+            if frappe.cache().get_value(REGISTERED_SESSION_KEY) != session_id:
+                register_units(session_id, resource_id)
+
+            data = client.poll_events(session_id)
+        except WialonAPIError as e:
+            if e.code == INVALID_SESSION:
+                invalidate_session(session_id)
+                continue
+            frappe.log_error(f"Position polling failed: {str(e)}", "Wialon Position Poller")
+            return
+
+        events = data.get("events", [])
+        changed = apply_position_updates(collect_position_updates(events), resource_id=resource_id)
+        touch_fleet_state()
+        positions_log.sampled("poll_cycle", level=logging.DEBUG, every=60, events=len(events), changed=len(changed))
+
+        time.sleep(POLL_INTERVAL)
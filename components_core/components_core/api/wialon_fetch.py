@@ -1,53 +1,113 @@
 import frappe
-import requests
-import json
+from frappe.utils import flt, now_datetime
+from components_core.api.wialon_client import get_client, WialonAPIError
 
-WIALON_API_URL = "https://hst-api.wialon.com/wialon/ajax.html"
+UPSERT_CHUNK_SIZE = 500  # Rows per multi-row INSERT statement
 
 @frappe.whitelist()
 def fetch_wialon_units():
-    """Fetch all units from Wialon API and store them in Frappe."""
-    config = frappe.get_single("Wialon API Configuration")
+    """Fetch all units from Wialon API and sync them into Wialon Tracked Unit."""
+    try:
+        spec = {"itemsType": "avl_unit", "propName": "sys_name", "propValueMask": "*", "sortType": "sys_name"}
 
-    if not config.session_id:
-        return {"error": "Wialon session ID not found. Try authenticating again."}
+        units = {}
+        for unit in get_client().iter_items(spec, 1):
+            units[str(unit["id"])] = {
+                "unit_name": unit["nm"],
+                "latitude": unit["pos"]["y"] if "pos" in unit else None,
+                "longitude": unit["pos"]["x"] if "pos" in unit else None
+            }
 
-    try:
-        response = requests.get(
-            WIALON_API_URL,
-            params={
-                "svc": "core/search_items",
-                "params": json.dumps({
-                    "spec": {"itemsType": "avl_unit", "propName": "sys_name", "propValueMask": "*", "sortType": "sys_name"},
-                    "force": 1,
-                    "flags": 1,
-                    "from": 0,
-                    "to": 0
-                }),
-                "sid": config.session_id
-            },
-            timeout=10
+        if not units:
+            return {"error": "No units found in Wialon."}
+
+        counts = upsert_tracked_units(units)
+        frappe.db.commit()
+
+        counts["success"] = (
+            f"Synced {len(units)} units: {counts['inserted']} inserted, "
+            f"{counts['updated']} updated, {counts['unchanged']} unchanged."
         )
-        response.raise_for_status()
-        data = response.json()
-
-        if "items" in data:
-            for unit in data["items"]:
-                unit_doc = frappe.get_doc({
-                    "doctype": "Wialon Tracked Unit",
-                    "unit_id": unit["id"],
-                    "unit_name": unit["nm"],
-                    "latitude": unit["pos"]["y"] if "pos" in unit else None,
-                    "longitude": unit["pos"]["x"] if "pos" in unit else None,
-                    "last_update": frappe.utils.now_datetime()
-                })
-                unit_doc.insert(ignore_permissions=True)
-
-            frappe.db.commit()
-            return {"success": f"Fetched {len(data['items'])} units successfully."}
-
-        return {"error": "No units found in Wialon."}
-
-    except requests.exceptions.RequestException as e:
+        return counts
+
+    except WialonAPIError as e:
         frappe.log_error(f"Wialon Fetch Units Error: {str(e)}")
         return {"error": f"Connection error: {str(e)}"}
+
+def upsert_tracked_units(units):
+    """Insert or update Wialon Tracked Unit rows keyed on unit_id.
+
+    Existing rows are read in one query and only new or changed units are
+    written, UPSERT_CHUNK_SIZE rows per INSERT ... ON DUPLICATE KEY UPDATE.
+
+    Args:
+        units (dict): unit_id -> {"unit_name", "latitude", "longitude"}.
+
+    Returns:
+        dict: ``{"inserted": int, "updated": int, "unchanged": int}``.
+    """
+    existing = {
+        row.unit_id: row
+        for row in frappe.db.sql(
+            "select unit_id, unit_name, latitude, longitude from `tabWialon Tracked Unit`",
+            as_dict=True
+        )
+    }
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    changed = []
+    for unit_id, values in units.items():
+        current = existing.get(unit_id)
+        if current is None:
+            counts["inserted"] += 1
+        elif _tracked_unit_changed(current, values):
+            counts["updated"] += 1
+        else:
+            counts["unchanged"] += 1
+            continue
+        changed.append((unit_id, values))
+
+    now = now_datetime()
+    user = frappe.session.user
+    for start in range(0, len(changed), UPSERT_CHUNK_SIZE):
+        chunk = changed[start:start + UPSERT_CHUNK_SIZE]
+
+        # The name is only used for new rows; existing rows keep theirs
+        values = []
+        for unit_id, unit in chunk:
+            values.extend([
+                frappe.generate_hash(length=10), now, now, user, user, 0,
+                unit_id, unit["unit_name"], unit["latitude"], unit["longitude"], now
+            ])
+
+        frappe.db.sql(
+            f"""
+            insert into `tabWialon Tracked Unit`
+                (name, creation, modified, owner, modified_by, docstatus,
+                unit_id, unit_name, latitude, longitude, last_update)
+            values {", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))}
+            on duplicate key update
+                unit_name = values(unit_name),
+                latitude = values(latitude),
+                longitude = values(longitude),
+                last_update = values(last_update),
+                modified = values(modified),
+                modified_by = values(modified_by)
+            """,
+            values
+        )
+
+    return counts
+
+def _tracked_unit_changed(current, values):
+    if current.unit_name != values["unit_name"]:
+        return True
+
+    # Float columns store 9 decimals; compare at that precision
+    for field in ("latitude", "longitude"):
+        if (current[field] is None) != (values[field] is None):
+            return True
+        if values[field] is not None and flt(current[field], 9) != flt(values[field], 9):
+            return True
+
+    return False
@@ -0,0 +1,200 @@
+import frappe
+import pickle
+import time
+from datetime import datetime
+from frappe.realtime import get_doctype_room
+from frappe.utils import cint
+
+# Live fleet state kept in Redis by the avl_evts poller (see wialon_events).
+# FLEET_STATE_KEY is a hash of unit_id -> position, stored with the same
+# pickle encoding frappe.cache().hset uses so hgetall can read it back.
+FLEET_STATE_KEY = "wialon_fleet_state"
+FLEET_HEARTBEAT_KEY = "wialon_fleet_heartbeat"
+FLEET_HEARTBEAT_TTL = 30  # Fleet state is served only while the poller is alive
+
+# Every write takes a new version from FLEET_VERSION_SEQ_KEY and publishes it
+# in FLEET_VERSION_KEY atomically with the data. FLEET_CHANGES_KEY is a sorted
+# set of unit_id scored by the version it last changed in, so clients can ask
+# for everything newer than the version they last saw. FLEET_RESET_KEY holds
+# the version of the last full replace; clients older than that need a snapshot.
+FLEET_VERSION_SEQ_KEY = "wialon_fleet_version_seq"
+FLEET_VERSION_KEY = "wialon_fleet_version"
+FLEET_CHANGES_KEY = "wialon_fleet_changes"
+FLEET_RESET_KEY = "wialon_fleet_reset_version"
+FLEET_RESOURCE_KEY = "wialon_fleet_resource"  # Resource of the account the fleet state was registered with
+
+# Takes the next version and writes the positions, their change-log entries
+# and the published version in one step, so a reader can never see version N
+# before N's rows. ARGV[1] is "1" for a full replace; the rest are unit_id,
+# pickled position pairs.
+WRITE_SCRIPT = """
+local version = redis.call("incr", KEYS[1])
+if ARGV[1] == "1" then
+    redis.call("del", KEYS[2], KEYS[3])
+    redis.call("set", KEYS[5], version)
+end
+for i = 2, #ARGV, 2 do
+    redis.call("hset", KEYS[2], ARGV[i], ARGV[i + 1])
+    redis.call("zadd", KEYS[3], version, ARGV[i])
+end
+redis.call("set", KEYS[4], version)
+return version
+"""
+
+# Every write is also pushed to browsers over Frappe's socket.io as one compact
+# batch. Browsers can only join permission-checked doctype/doc rooms, and the
+# resources only exist as rows of the System Manager-only Wialon API
+# Configuration, so batches go to the Wialon Tracked Unit doctype room tagged
+# with their resource. Clients drop batches for a resource they do not show.
+REALTIME_DOCTYPE = "Wialon Tracked Unit"
+REALTIME_EVENT = "wialon_positions"
+REALTIME_MAX_UNITS = 1000  # Bigger batches are announced as a resync instead
+
+def format_position(unit_id, name, pos):
+    """Convert a Wialon position object to the format returned by get_live_positions."""
+    return {
+        "unit_id": unit_id,
+        "name": name,
+        "latitude": pos["y"],
+        "longitude": pos["x"],
+        "speed": pos.get("s", 0),
+        "last_updated": datetime.fromtimestamp(pos["t"]).strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+def is_fleet_state_live():
+    """Return True while the position poller is keeping the fleet state current."""
+    return bool(frappe.cache().get_value(FLEET_HEARTBEAT_KEY, expires=True))
+
+def touch_fleet_state():
+    """Mark the fleet state as live; called by the poller on every cycle."""
+    frappe.cache().set_value(FLEET_HEARTBEAT_KEY, time.time(), expires_in_sec=FLEET_HEARTBEAT_TTL)
+
+def get_fleet_positions():
+    """Return every unit position in the fleet state, sorted by unit name."""
+    positions = list(frappe.cache().hgetall(FLEET_STATE_KEY).values())
+    positions.sort(key=lambda p: p["name"] or "")
+    return positions
+
+def get_unit_positions(unit_ids):
+    """Return the stored positions for the given unit IDs, keyed by unit ID."""
+    if not unit_ids:
+        return {}
+
+    cache = frappe.cache()
+    values = cache.hmget(cache.make_key(FLEET_STATE_KEY), [str(unit_id) for unit_id in unit_ids])
+    return {
+        unit_id: pickle.loads(value)
+        for unit_id, value in zip(unit_ids, values)
+        if value is not None
+    }
+
+def get_fleet_version():
+    """Return the current fleet state version."""
+    cache = frappe.cache()
+    return int(cache.get(cache.make_key(FLEET_VERSION_KEY)) or 0)
+
+def get_fleet_resource_id():
+    """Return the resource the fleet state was last registered with, or None."""
+    return frappe.cache().get_value(FLEET_RESOURCE_KEY)
+
+def get_positions_since(version):
+    """Return the positions that changed after ``version``.
+
+    Returns:
+        dict: ``{"version": int, "full": bool, "units": list, "resource_id": int}``.
+        ``full`` is set when the client has no version yet (or sent something
+        that is not one) or is older than the last full replace, in which case
+        ``units`` is the whole fleet and the client should drop anything else.
+        ``resource_id`` is the resource the fleet state belongs to.
+    """
+    cache = frappe.cache()
+    version = cint(version)
+
+    current, reset = cache.mget(cache.make_key(FLEET_VERSION_KEY), cache.make_key(FLEET_RESET_KEY))
+    current, reset = int(current or 0), int(reset or 0)
+
+    if version <= 0 or version < reset or version > current:
+        return {"version": current, "full": True, "units": get_fleet_positions(), "resource_id": get_fleet_resource_id()}
+
+    changed_ids = [
+        unit_id.decode() for unit_id in
+        cache.zrangebyscore(cache.make_key(FLEET_CHANGES_KEY), f"({version}", "+inf")
+    ]
+    return {
+        "version": current,
+        "full": False,
+        "units": list(get_unit_positions(changed_ids).values()),
+        "resource_id": get_fleet_resource_id()
+    }
+
+def replace_fleet_state(positions, resource_id=None):
+    """Replace the whole fleet state, e.g. after registering units with a new session."""
+    frappe.cache().set_value(FLEET_RESOURCE_KEY, resource_id)
+    version = _write_positions(positions, replace=True)
+    publish_fleet_changes(version, positions, full=True, resource_id=resource_id)
+    return positions
+
+def apply_position_updates(updates, resource_id=None):
+    """Merge position deltas into the fleet state.
+
+    Args:
+        updates (dict): unit_id -> {"pos": {...}, "nm": <optional new name>}.
+        resource_id (int, optional): Resource the updates belong to, for realtime subscribers.
+
+    Returns:
+        list: Positions that actually changed, in get_live_positions format.
+    """
+    if not updates:
+        return []
+
+    current = get_unit_positions(list(updates))
+    changed = []
+
+    for unit_id, update in updates.items():
+        previous = current.get(unit_id)
+        name = update.get("nm") or (previous["name"] if previous else str(unit_id))
+        position = format_position(unit_id, name, update["pos"])
+
+        if position != previous:
+            changed.append(position)
+
+    if changed:
+        version = _write_positions(changed)
+        publish_fleet_changes(version, changed, resource_id=resource_id)
+
+    return changed
+
+def _write_positions(positions, replace=False):
+    # Returns the version the write was published under
+    cache = frappe.cache()
+    args = ["1" if replace else "0"]
+    for p in positions:
+        args.extend((str(p["unit_id"]), pickle.dumps(p)))
+
+    write = cache.register_script(WRITE_SCRIPT)
+    return write(keys=[
+        cache.make_key(FLEET_VERSION_SEQ_KEY),
+        cache.make_key(FLEET_STATE_KEY),
+        cache.make_key(FLEET_CHANGES_KEY),
+        cache.make_key(FLEET_VERSION_KEY),
+        cache.make_key(FLEET_RESET_KEY)
+    ], args=args)
+
+def publish_fleet_changes(version, positions, full=False, resource_id=None):
+    """Push one fleet state write to subscribed browsers.
+
+    Units are sent as ``[unit_id, name, latitude, longitude, speed, last_updated]``
+    rows. Versions are consecutive, so a client that sees a gap (or ``full``)
+    resyncs with get_live_positions_since instead of applying the batch.
+    """
+    message = {"version": version, "resource_id": resource_id, "full": 0}
+
+    if full or len(positions) > REALTIME_MAX_UNITS:
+        message["full"] = 1
+    else:
+        message["units"] = [
+            [p["unit_id"], p["name"], p["latitude"], p["longitude"], p["speed"], p["last_updated"]]
+            for p in positions
+        ]
+
+    frappe.publish_realtime(REALTIME_EVENT, message, room=get_doctype_room(REALTIME_DOCTYPE))
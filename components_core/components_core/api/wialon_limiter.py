@@ -0,0 +1,203 @@
+import frappe
+import time
+from components_core.api.wialon_client import WialonCircuitOpenError, WialonRateLimitError
+from components_core.api.wialon_config import DEFAULT_ACCOUNT
+from components_core.api.wialon_log import get_logger
+
+# Admission control for Wialon calls, shared by every worker through Redis:
+#
+# - A token bucket per account (wialon_rate_limit requests per second, bursts
+#   of up to wialon_rate_burst). Lower priorities may only take a token while
+#   their reserve of the bucket is left over, so browser requests still get
+#   through while a backfill is draining it.
+# - A circuit breaker per site. CIRCUIT_FAILURE_THRESHOLD failed calls within
+#   CIRCUIT_FAILURE_WINDOW open it for CIRCUIT_OPEN_SECONDS, during which calls
+#   fail fast and cached callers serve their stale data. Then a single probe
+#   call is let through; it closes the circuit or opens it again.
+RATE_LIMIT_KEY = "wialon_rate_limit"
+RATE_LIMIT_CONFIG = "wialon_rate_limit"
+RATE_BURST_CONFIG = "wialon_rate_burst"
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_RATE_BURST = 20
+
+INTERACTIVE = "interactive"
+SCHEDULED = "scheduled"
+BACKFILL = "backfill"
+PRIORITY_RESERVES = {INTERACTIVE: 0, SCHEDULED: 0.2, BACKFILL: 0.5}  # Share of the burst left for higher priorities
+PRIORITY_MAX_WAIT = {INTERACTIVE: 2, SCHEDULED: 30, BACKFILL: 120}  # Seconds to wait for a token before giving up
+
+CIRCUIT_KEY = "wialon_circuit"
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_FAILURE_WINDOW = 60
+CIRCUIT_OPEN_SECONDS = 30
+CIRCUIT_PROBE_TIMEOUT = 60
+
+# Returns {0, 0} to proceed, {1, wait ms} when out of tokens, {2, wait ms}
+# while the circuit is open, or {3, 0} to proceed as the half-open probe
+ADMIT_SCRIPT = """
+if redis.call("exists", KEYS[2]) == 1 then
+    return {2, redis.call("pttl", KEYS[2])}
+end
+
+local probe = 0
+if redis.call("exists", KEYS[3]) == 1 then
+    if not redis.call("set", KEYS[4], "1", "NX", "EX", ARGV[4]) then
+        return {2, 1000}
+    end
+    probe = 1
+end
+
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local time = redis.call("time")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local state = redis.call("hmget", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or burst
+local last = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - last) * rate / 1000)
+
+local granted = tokens - 1 >= reserve
+if granted then
+    tokens = tokens - 1
+elseif probe == 1 then
+    redis.call("del", KEYS[4])
+end
+redis.call("hset", KEYS[1], "tokens", tostring(tokens), "ts", now)
+redis.call("pexpire", KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+
+if not granted then
+    return {1, math.ceil((reserve + 1 - tokens) * 1000 / rate)}
+end
+return {probe == 1 and 3 or 0, 0}
+"""
+
+client_log = get_logger("client")
+
+_guards = {}
+
+
+class CallGuard:
+    """Rate limiter and circuit breaker for one site, account and priority.
+
+    Keys, settings and the logger are resolved when the guard is built, so a
+    guard made on the job thread can be handed to worker threads that have
+    no frappe.local (see get_guard).
+    """
+
+    def __init__(self, account=DEFAULT_ACCOUNT, priority=SCHEDULED):
+        self.cache = frappe.cache()
+        self.account = account
+        self.priority = priority
+        self.rate = max(float(frappe.conf.get(RATE_LIMIT_CONFIG) or DEFAULT_RATE_LIMIT), 0.1)
+        self.burst = max(float(frappe.conf.get(RATE_BURST_CONFIG) or DEFAULT_RATE_BURST), 1)
+        self.reserve = self.burst * PRIORITY_RESERVES[priority]
+        self.max_wait = PRIORITY_MAX_WAIT[priority]
+        self.log = client_log.bind()
+
+        self.keys = [
+            self.cache.make_key(f"{RATE_LIMIT_KEY}|{account}"),
+            self.cache.make_key(f"{CIRCUIT_KEY}|open"),
+            self.cache.make_key(f"{CIRCUIT_KEY}|half_open"),
+            self.cache.make_key(f"{CIRCUIT_KEY}|probe")
+        ]
+        self.failures_key = self.cache.make_key(f"{CIRCUIT_KEY}|failures")
+        self._admit = self.cache.register_script(ADMIT_SCRIPT)
+
+    def admit(self, svc):
+        """Wait for a token; return True if this call is the half-open probe.
+
+        Raises WialonCircuitOpenError while the circuit is open and
+        WialonRateLimitError if no token frees up within the priority's wait.
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            status, wait_ms = self._admit(
+                keys=self.keys,
+                args=[self.rate, self.burst, self.reserve, CIRCUIT_PROBE_TIMEOUT]
+            )
+            if status in (0, 3):
+                return status == 3
+            if status == 2:
+                raise WialonCircuitOpenError(f"Wialon circuit is open; not calling {svc}", svc=svc)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.log.sampled("rate_limited", svc=svc, account=self.account, priority=self.priority)
+                raise WialonRateLimitError(f"Wialon rate limit reached for {svc}", svc=svc)
+            time.sleep(min(wait_ms / 1000, remaining))
+
+    def record_success(self, probe):
+        """Close the circuit if this call was the probe."""
+        if not probe:
+            return
+        self.cache.delete(self.keys[2], self.keys[3], self.failures_key)
+        self.log.warning("circuit_closed")
+
+    def record_failure(self, probe, svc):
+        """Count a failed call, opening the circuit at the threshold or when the probe fails."""
+        pipe = self.cache.pipeline()
+        pipe.incr(self.failures_key)
+        pipe.expire(self.failures_key, CIRCUIT_FAILURE_WINDOW)
+        failures = pipe.execute()[0]
+
+        if not probe and failures < CIRCUIT_FAILURE_THRESHOLD:
+            return
+
+        pipe = self.cache.pipeline()
+        pipe.set(self.keys[1], 1, ex=CIRCUIT_OPEN_SECONDS)
+        pipe.set(self.keys[2], 1)
+        pipe.delete(self.keys[3], self.failures_key)
+        pipe.execute()
+        self.log.warning("circuit_opened", svc=svc, failures=failures, probe=probe, seconds=CIRCUIT_OPEN_SECONDS)
+
+
+def get_guard(account=None, priority=None):
+    """Return the CallGuard for the current site, or None outside a site context.
+
+    ``priority`` defaults to INTERACTIVE within a web request and SCHEDULED
+    otherwise. Call this on the job thread and pass the guard to threads.
+    """
+    site = getattr(frappe.local, "site", None)
+    if not site:
+        return None
+
+    account = account or DEFAULT_ACCOUNT
+    priority = priority or (INTERACTIVE if getattr(frappe.local, "request", None) else SCHEDULED)
+
+    key = (site, account, priority)
+    guard = _guards.get(key)
+    if guard is None:
+        guard = _guards[key] = CallGuard(account, priority)
+    return guard
+
+def is_circuit_open():
+    """Return True while the circuit is open, i.e. Wialon calls fail fast."""
+    cache = frappe.cache()
+    return cache.get(cache.make_key(f"{CIRCUIT_KEY}|open")) is not None
+
+@frappe.whitelist()
+def get_limiter_status():
+    """Return the circuit state and each account's remaining tokens."""
+    frappe.only_for("System Manager")
+
+    # Plain strings, so read them raw rather than through the unpickling wrappers
+    cache = frappe.cache()
+    bucket_keys = list(cache.scan_iter(cache.make_key(f"{RATE_LIMIT_KEY}|*")))
+    pipe = cache.pipeline()
+    for suffix in ("open", "half_open", "failures"):
+        pipe.get(cache.make_key(f"{CIRCUIT_KEY}|{suffix}"))
+    for key in bucket_keys:
+        pipe.hget(key, "tokens")
+    is_open, half_open, failures, *tokens = pipe.execute()
+
+    return {
+        "circuit_open": is_open is not None,
+        "half_open": half_open is not None,
+        "recent_failures": int(failures or 0),
+        "tokens": {
+            key.decode().rsplit("|", 1)[1]: round(float(count), 2) if count else None
+            for key, count in zip(bucket_keys, tokens)
+        }
+    }
@@ -0,0 +1,142 @@
+import frappe
+import functools
+import inspect
+import threading
+from components_core.api.wialon_log import get_logger
+
+# Lease locks for scheduled runs. A lock is a Redis key holding a random
+# token with a TTL (the lease); the holder renews it from a heartbeat thread
+# while it runs, so a crashed worker frees the lock within one lease instead
+# of blocking the task until someone clears it by hand.
+LOCK_KEY_PREFIX = "wialon_run_lock"
+SKIPPED_RUNS_KEY = "wialon_skipped_runs"
+DEFAULT_LEASE = 120  # Seconds; renewed every lease / 3 while the run is alive
+
+# Renew or release only while the key still holds our token
+RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+locks_log = get_logger("locks")
+
+
+class LeaseLock:
+    """Redis lease lock with heartbeat renewal, usable as a context manager.
+
+        with LeaseLock("wialon_ingest_123_Messages") as lock:
+            if lock.acquired:
+                ...
+
+    A run that finds the lock taken is counted in SKIPPED_RUNS_KEY rather
+    than waiting for it.
+    """
+
+    def __init__(self, name, lease=DEFAULT_LEASE):
+        self.name = name
+        self.lease = lease
+        self.cache = frappe.cache()
+        self.key = self.cache.make_key(f"{LOCK_KEY_PREFIX}|{name}")
+        self.token = frappe.generate_hash(length=20)
+        self.acquired = False
+        self.lost = False
+        self._renew = self.cache.register_script(RENEW_SCRIPT)
+        self._release = self.cache.register_script(RELEASE_SCRIPT)
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def acquire(self):
+        """Try to take the lock once; start renewing it if that succeeded."""
+        self.acquired = bool(self.cache.set(self.key, self.token, nx=True, ex=self.lease))
+        if not self.acquired:
+            record_skipped_run(self.name)
+            return False
+
+        # The heartbeat thread only talks to Redis, never to frappe.local
+        self._heartbeat = threading.Thread(target=self._renew_until_stopped, name=f"lease-{self.name}", daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def release(self):
+        if not self.acquired:
+            return
+
+        self._stop.set()
+        self._heartbeat.join()
+        self._release(keys=[self.key], args=[self.token])
+        self.acquired = False
+
+        if self.lost:
+            locks_log.warning("lease_lost", lock=self.name, lease=self.lease)
+
+    def _renew_until_stopped(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                renewed = self._renew(keys=[self.key], args=[self.token, self.lease])
+            except Exception:
+                # A Redis blip; the lease still has time left, try again next beat
+                continue
+            if not renewed:
+                # Expired and possibly taken over; the run keeps going but is reported
+                self.lost = True
+                return
+
+
+def run_lock(name, lease=DEFAULT_LEASE):
+    """Decorator: run the function only if no other run holds the same lease lock.
+
+    ``name`` may contain ``{argument}`` placeholders filled from the call's
+    arguments, giving one lock per shard:
+
+        @run_lock("wialon_ingest_{resource_id}_Messages")
+        def ingest_messages(resource_id): ...
+
+    Skipped calls return None and are counted by record_skipped_run.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+
+            with LeaseLock(name.format(**bound.arguments), lease) as lock:
+                if lock.acquired:
+                    return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+def record_skipped_run(name):
+    """Count a run skipped because another worker held its lock."""
+    cache = frappe.cache()
+    count = cache.hincrby(cache.make_key(SKIPPED_RUNS_KEY), name, 1)
+    locks_log.info("run_skipped", lock=name, skipped_total=count)
+
+@frappe.whitelist()
+def get_skipped_runs():
+    """Return how many runs each lock has skipped."""
+    frappe.only_for("System Manager")
+
+    # Counters are plain integers, so read them raw rather than through the
+    # unpickling RedisWrapper.hgetall
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    pipe.hgetall(cache.make_key(SKIPPED_RUNS_KEY))
+    return {name.decode(): int(count) for name, count in pipe.execute()[0].items()}
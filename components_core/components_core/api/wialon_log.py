@@ -0,0 +1,146 @@
+import frappe
+import json
+import logging
+import threading
+
+# Structured, level-gated logging for the Wialon ingestion paths. Records go to
+# the site's wialon.log as one compact JSON object per line:
+#
+#   {"stream": "messages", "event": "batch_saved", "inserted": 1800, ...}
+#
+# Site config:
+#   wialon_log_level     minimum level to write (default "INFO")
+#   wialon_debug_streams streams to log at DEBUG regardless of the level,
+#                        e.g. ["messages"], or ["*"] for all
+LOGGER_NAME = "wialon"
+LOG_LEVEL_CONFIG = "wialon_log_level"
+DEBUG_STREAMS_CONFIG = "wialon_debug_streams"
+DEFAULT_LOG_LEVEL = "INFO"
+DEFAULT_SAMPLE_EVERY = 100
+
+_sample_counts = {}
+_sample_lock = threading.Lock()
+
+
+class WialonLogger:
+    """Logger for one ingestion stream (e.g. "notifications", "messages", "positions").
+
+    Level checks happen before any record is built, and fields are only
+    serialized when the record is written, so a disabled debug() call with a
+    full API payload costs a config lookup. Pass payloads as fields rather
+    than pre-formatted strings to keep it that way.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def bind(self):
+        """Return this stream's logger with the site, settings and log file resolved now.
+
+        The result can log from threads without frappe.local, e.g. from
+        objects built on the job thread and handed to worker threads.
+        Settings changed afterwards are not picked up.
+        """
+        return BoundWialonLogger(self.stream)
+
+    def is_enabled(self, level):
+        if level >= _configured_level():
+            return True
+        return level == logging.DEBUG and self.is_debug()
+
+    def is_debug(self):
+        streams = frappe.conf.get(DEBUG_STREAMS_CONFIG) or []
+        return "*" in streams or self.stream in streams
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def summary(self, event, **counts):
+        """Write one INFO record summarizing a batch, e.g. rows inserted and skipped."""
+        self._log(logging.INFO, event, counts)
+
+    def sampled(self, event, level=logging.INFO, every=DEFAULT_SAMPLE_EVERY, **fields):
+        """Write only the 1st, (every + 1)-th, (2 * every + 1)-th ... occurrence of a repetitive record.
+
+        Written records carry ``occurrences``, how often the event has
+        happened in this process so far.
+        """
+        if not self.is_enabled(level):
+            return
+
+        key = (self._site(), self.stream, event)
+        with _sample_lock:
+            count = _sample_counts[key] = _sample_counts.get(key, 0) + 1
+        if count % every == 1 or every == 1:
+            self._log(level, event, dict(fields, occurrences=count))
+
+    def _log(self, level, event, fields):
+        if not self.is_enabled(level):
+            return
+        self._logger().log(level, "%s", _Record(self.stream, event, fields))
+
+    def _site(self):
+        return frappe.local.site
+
+    def _logger(self):
+        return _get_logger()
+
+
+class BoundWialonLogger(WialonLogger):
+    """WialonLogger that needs no frappe.local once built; see WialonLogger.bind."""
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.site = frappe.local.site
+        self.level = _configured_level()
+        self.debug_enabled = WialonLogger.is_debug(self)
+        self.logger = _get_logger()
+
+    def is_enabled(self, level):
+        return level >= self.level or (level == logging.DEBUG and self.debug_enabled)
+
+    def is_debug(self):
+        return self.debug_enabled
+
+    def _site(self):
+        return self.site
+
+    def _logger(self):
+        return self.logger
+
+
+class _Record:
+    # Formatted by the logging handler, i.e. only once the record is emitted
+    def __init__(self, stream, event, fields):
+        self.stream = stream
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        record = {"stream": self.stream, "event": self.event}
+        record.update(self.fields)
+        return json.dumps(record, default=str, separators=(",", ":"))
+
+
+def get_logger(stream):
+    """Return the structured logger for an ingestion stream."""
+    return WialonLogger(stream)
+
+def _get_logger():
+    # Levels are gated per stream above, so the underlying logger lets everything through
+    logger = frappe.logger(LOGGER_NAME, allow_site=True, file_count=10)
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+def _configured_level():
+    level = logging.getLevelName(str(frappe.conf.get(LOG_LEVEL_CONFIG) or DEFAULT_LOG_LEVEL).upper())
+    return level if isinstance(level, int) else logging.INFO
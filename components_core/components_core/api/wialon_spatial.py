@@ -0,0 +1,413 @@
+import frappe
+import math
+import time
+from frappe.utils import cint, flt
+from components_core.api.wialon_fleet import get_positions_since, is_fleet_state_live
+from components_core.api.wialon_units import get_live_positions
+
+GRID_CELL_DEG = 0.05  # ~5.5 km cells: a city viewport touches a few dozen cells
+INDEX_SYNC_INTERVAL = 0.5  # Seconds between change-log reads per process
+INDEX_RELOAD_INTERVAL = 30  # Seconds between full reloads while the poller is not running
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = 111320
+
+# Marker clustering on 256px Web Mercator tiles: units within the same
+# CLUSTER_CELL_PX square at a zoom level form one cluster. Above
+# CLUSTER_MAX_ZOOM individual units are returned instead.
+CLUSTER_CELL_PX = 64
+CLUSTER_MAX_ZOOM = 16
+MERCATOR_MAX_LAT = 85.05112878
+
+# One index per site per process, kept current from the fleet change log
+_indexes = {}
+
+
+class FleetGrid:
+    """Uniform latitude/longitude grid over unit positions.
+
+    Each unit lives in exactly one cell; moving a unit only touches its old
+    and new cell, so the grid is maintained incrementally as deltas arrive.
+    """
+
+    def __init__(self, cell_size=GRID_CELL_DEG):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.units = {}
+
+    def __len__(self):
+        return len(self.units)
+
+    def clear(self):
+        self.cells.clear()
+        self.units.clear()
+
+    def upsert(self, position):
+        """Insert a unit position or move an existing unit to its new cell."""
+        unit_id = str(position["unit_id"])
+        cell = self._cell(position["latitude"], position["longitude"])
+
+        previous = self.units.get(unit_id)
+        if previous and previous[0] != cell:
+            self._remove_from_cell(previous[0], unit_id)
+
+        self.cells.setdefault(cell, {})[unit_id] = position
+        self.units[unit_id] = (cell, position)
+
+    def in_bbox(self, south, west, north, east):
+        """Return positions inside a bounding box; west > east crosses the antimeridian.
+
+        Longitudes past +/-180, as Leaflet reports them once the map wraps,
+        are normalised first.
+        """
+        west, east = _wrap_lng_range(west, east)
+        if west > east:
+            return self.in_bbox(south, west, north, 180) + self.in_bbox(south, -180, north, east)
+
+        min_row, min_col = self._cell(south, west)
+        max_row, max_col = self._cell(north, east)
+        results = []
+
+        # Iterate whichever is smaller: the cells covered or the occupied cells
+        if (max_row - min_row + 1) * (max_col - min_col + 1) <= len(self.cells):
+            cells = (
+                self.cells.get((row, col))
+                for row in range(min_row, max_row + 1)
+                for col in range(min_col, max_col + 1)
+            )
+        else:
+            cells = (
+                units for (row, col), units in self.cells.items()
+                if min_row <= row <= max_row and min_col <= col <= max_col
+            )
+
+        for units in cells:
+            if not units:
+                continue
+            for position in units.values():
+                if south <= position["latitude"] <= north and west <= position["longitude"] <= east:
+                    results.append(position)
+
+        return results
+
+    def within_radius(self, latitude, longitude, radius_m):
+        """Return positions within radius_m metres, nearest first, with a distance_m field."""
+        dlat = radius_m / METERS_PER_DEG_LAT
+        dlng = dlat / max(math.cos(math.radians(latitude)), 1e-6)
+
+        south, north = max(latitude - dlat, -90), min(latitude + dlat, 90)
+        if dlng >= 180:
+            candidates = self.in_bbox(south, -180, north, 180)
+        else:
+            west, east = longitude - dlng, longitude + dlng
+            candidates = self.in_bbox(south, _wrap_lng(west), north, _wrap_lng(east))
+
+        results = []
+        for position in candidates:
+            distance = haversine(latitude, longitude, position["latitude"], position["longitude"])
+            if distance <= radius_m:
+                results.append(dict(position, distance_m=round(distance, 1)))
+
+        results.sort(key=lambda p: p["distance_m"])
+        return results
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size))
+
+    def _remove_from_cell(self, cell, unit_id):
+        units = self.cells.get(cell)
+        if units is not None:
+            units.pop(unit_id, None)
+            if not units:
+                del self.cells[cell]
+
+
+class ClusterIndex:
+    """Hierarchical grid clusters of unit positions, one level per zoom.
+
+    At every zoom a cluster cell is CLUSTER_CELL_PX on screen, so a cell at
+    zoom z is exactly four cells at z + 1. Only the deepest level is built
+    from positions; each coarser level is built by merging the level below.
+    Levels are cached and kept current by update(), which recomputes only
+    the cells units moved out of or into and their parents.
+    """
+
+    def __init__(self, positions):
+        self.units = {}  # unit_id -> (deepest-level cell, position)
+        self.members = {}  # deepest-level cell -> {unit_id: position}
+        self.levels = {}
+        for position in positions:
+            self._place(position)
+
+    def update(self, positions):
+        """Add or move units, updating the levels built so far in place."""
+        cells = set()
+        for position in positions:
+            cells.update(self._place(position))
+
+        # Levels are built from the deepest one up, so the built ones are contiguous
+        zoom = CLUSTER_MAX_ZOOM
+        while zoom in self.levels and cells:
+            level = self.levels[zoom]
+            for cell in cells:
+                cluster = self._build_cell(zoom, cell)
+                if cluster:
+                    level[cell] = cluster
+                else:
+                    level.pop(cell, None)
+            cells = {(x // 2, y // 2) for x, y in cells}
+            zoom -= 1
+
+    def clusters(self, zoom, south, west, north, east):
+        """Return clusters at ``zoom`` whose centre lies inside the bounding box."""
+        level = self._level(zoom)
+
+        min_x, max_y = self._cell(zoom, south, west)
+        max_x, min_y = self._cell(zoom, north, east)
+
+        # A viewport crossing the antimeridian covers two column ranges
+        if west > east:
+            x_ranges = [(min_x, self._cells_per_side(zoom) - 1), (0, max_x)]
+        else:
+            x_ranges = [(min_x, max_x)]
+
+        # Walk the viewport's cells when that is cheaper than scanning the level
+        viewport_cells = sum(hi - lo + 1 for lo, hi in x_ranges) * (max_y - min_y + 1)
+        if viewport_cells <= len(level):
+            clusters = (
+                level.get((x, y))
+                for lo, hi in x_ranges
+                for x in range(lo, hi + 1)
+                for y in range(min_y, max_y + 1)
+            )
+        else:
+            clusters = (
+                cluster for (x, y), cluster in level.items()
+                if min_y <= y <= max_y and any(lo <= x <= hi for lo, hi in x_ranges)
+            )
+
+        return [self._format(cluster) for cluster in clusters if cluster]
+
+    def _level(self, zoom):
+        level = self.levels.get(zoom)
+        if level is not None:
+            return level
+
+        level = {}
+        if zoom == CLUSTER_MAX_ZOOM:
+            for cell, units in self.members.items():
+                for position in units.values():
+                    level[cell] = self._merge(level.get(cell), 1, position["latitude"], position["longitude"], position)
+        else:
+            for (x, y), child in self._level(zoom + 1).items():
+                cell = (x // 2, y // 2)
+                level[cell] = self._merge(level.get(cell), child["count"], child["lat_sum"], child["lng_sum"], child["unit"])
+
+        self.levels[zoom] = level
+        return level
+
+    def _build_cell(self, zoom, cell):
+        # The cluster for one cell, from its units at the deepest level and
+        # from its four children above that; None if the cell is empty
+        cluster = None
+        if zoom == CLUSTER_MAX_ZOOM:
+            for position in self.members.get(cell, {}).values():
+                cluster = self._merge(cluster, 1, position["latitude"], position["longitude"], position)
+        else:
+            children = self.levels[zoom + 1]
+            x, y = cell
+            for child_cell in ((2 * x, 2 * y), (2 * x + 1, 2 * y), (2 * x, 2 * y + 1), (2 * x + 1, 2 * y + 1)):
+                child = children.get(child_cell)
+                if child:
+                    cluster = self._merge(cluster, child["count"], child["lat_sum"], child["lng_sum"], child["unit"])
+        return cluster
+
+    def _merge(self, cluster, count, lat_sum, lng_sum, unit):
+        if cluster is None:
+            return {"count": count, "lat_sum": lat_sum, "lng_sum": lng_sum, "unit": unit}
+        cluster["count"] += count
+        cluster["lat_sum"] += lat_sum
+        cluster["lng_sum"] += lng_sum
+        cluster["unit"] = None
+        return cluster
+
+    def _place(self, position):
+        # Put a unit in its deepest-level cell; returns the cells it touched
+        unit_id = str(position["unit_id"])
+        cell = self._cell(CLUSTER_MAX_ZOOM, position["latitude"], position["longitude"])
+        touched = [cell]
+
+        previous = self.units.get(unit_id)
+        if previous and previous[0] != cell:
+            units = self.members[previous[0]]
+            del units[unit_id]
+            if not units:
+                del self.members[previous[0]]
+            touched.append(previous[0])
+
+        self.members.setdefault(cell, {})[unit_id] = position
+        self.units[unit_id] = (cell, position)
+        return touched
+
+    def _cell(self, zoom, latitude, longitude):
+        latitude = max(min(latitude, MERCATOR_MAX_LAT), -MERCATOR_MAX_LAT)
+        sin_lat = math.sin(math.radians(latitude))
+        x = (longitude + 180) / 360
+        y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+
+        cells = self._cells_per_side(zoom)
+        return (min(max(int(x * cells), 0), cells - 1), min(max(int(y * cells), 0), cells - 1))
+
+    def _cells_per_side(self, zoom):
+        return (256 << zoom) // CLUSTER_CELL_PX
+
+    def _format(self, cluster):
+        if cluster["count"] == 1:
+            return dict(cluster["unit"], count=1)
+        return {
+            "count": cluster["count"],
+            "latitude": cluster["lat_sum"] / cluster["count"],
+            "longitude": cluster["lng_sum"] / cluster["count"]
+        }
+
+
+class FleetIndex:
+    """Process-local FleetGrid kept in step with the Redis fleet state.
+
+    While the avl_evts poller is not running there is no fleet state to
+    follow; the index is then reloaded from get_live_positions every
+    INDEX_RELOAD_INTERVAL instead.
+    """
+
+    def __init__(self):
+        self.grid = FleetGrid()
+        self.cluster_index = None
+        self.version = 0
+        self.synced_at = 0
+        self.reloaded_at = None
+
+    def clusters(self):
+        """Return the cluster index for the current fleet, building it after a full reload."""
+        if self.cluster_index is None:
+            self.cluster_index = ClusterIndex([position for cell, position in self.grid.units.values()])
+        return self.cluster_index
+
+    def sync(self):
+        """Apply fleet changes since the last sync, at most every INDEX_SYNC_INTERVAL."""
+        now = time.monotonic()
+        if now - self.synced_at < INDEX_SYNC_INTERVAL:
+            return
+
+        if is_fleet_state_live():
+            self._apply_changes()
+        elif self.reloaded_at is None or now - self.reloaded_at >= INDEX_RELOAD_INTERVAL:
+            self._reload()
+        self.synced_at = now
+
+    def _apply_changes(self):
+        delta = get_positions_since(self.version)
+        if delta["full"]:
+            self.grid.clear()
+        for position in delta["units"]:
+            self.grid.upsert(position)
+        if delta["full"]:
+            self.cluster_index = None
+        elif delta["units"] and self.cluster_index is not None:
+            self.cluster_index.update(delta["units"])
+
+        self.version = delta["version"]
+        # Reload straight away if the poller stops
+        self.reloaded_at = None
+
+    def _reload(self):
+        positions = get_live_positions()
+        self.reloaded_at = time.monotonic()
+        if isinstance(positions, dict):
+            # Wialon is unavailable; keep serving what the index has
+            return
+
+        self.grid.clear()
+        for position in positions:
+            self.grid.upsert(position)
+        self.cluster_index = None
+        # The poller's first change-log read must be a full snapshot
+        self.version = 0
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1, math.sqrt(a)))
+
+def _wrap_lng(longitude):
+    if -180 <= longitude <= 180:
+        return longitude
+    return (longitude + 180) % 360 - 180
+
+def _wrap_lng_range(west, east):
+    # Leaflet reports longitudes past +/-180 when the world wraps
+    if east - west >= 360:
+        return -180, 180
+    return _wrap_lng(west), _wrap_lng(east)
+
+def get_fleet_index():
+    """Return this process's spatial index for the current site, synced with the fleet state."""
+    site = frappe.local.site
+    index = _indexes.get(site)
+    if index is None:
+        index = _indexes[site] = FleetIndex()
+
+    index.sync()
+    return index
+
+@frappe.whitelist()
+def units_in_bbox(south, west, north, east, limit=None):
+    """Return live unit positions inside a bounding box (e.g. the map viewport).
+
+    Args:
+        south, west, north, east (float): Box edges in degrees.
+        limit (int, optional): Maximum number of units to return.
+
+    Returns:
+        list: Unit positions in get_live_positions format.
+    """
+    units = get_fleet_index().grid.in_bbox(flt(south), flt(west), flt(north), flt(east))
+    return units[:cint(limit)] if limit else units
+
+@frappe.whitelist()
+def units_within_radius(latitude, longitude, radius, limit=None):
+    """Return live unit positions within ``radius`` metres of a point, nearest first.
+
+    Args:
+        latitude, longitude (float): Centre point in degrees.
+        radius (float): Search radius in metres.
+        limit (int, optional): Maximum number of units to return.
+
+    Returns:
+        list: Unit positions with an added ``distance_m`` field.
+    """
+    units = get_fleet_index().grid.within_radius(flt(latitude), flt(longitude), flt(radius))
+    return units[:cint(limit)] if limit else units
+
+@frappe.whitelist()
+def get_clusters(south, west, north, east, zoom):
+    """Return pre-clustered markers for a map viewport at a zoom level.
+
+    Args:
+        south, west, north, east (float): Viewport edges in degrees.
+        zoom (int): Map zoom level.
+
+    Returns:
+        list: Markers with a ``count``; single units (count 1) carry their
+        full position, clusters carry only their centre.
+    """
+    index = get_fleet_index()
+    south, west, north, east, zoom = flt(south), flt(west), flt(north), flt(east), max(cint(zoom), 0)
+
+    if zoom > CLUSTER_MAX_ZOOM:
+        return [dict(position, count=1) for position in index.grid.in_bbox(south, west, north, east)]
+
+    west, east = _wrap_lng_range(west, east)
+    return index.clusters().clusters(zoom, south, west, north, east)
@@ -1,93 +1,109 @@
 import frappe
-import requests
-import json
-from datetime import datetime
-from components_core.api.wialon_auth import validate_session, get_valid_session
-
-WIALON_API_URL = "https://hst-api.wialon.com/wialon/ajax.html"
+from components_core.api.wialon_cache import get_or_refresh
+from components_core.api.wialon_client import get_client, WialonAPIError, WialonCircuitOpenError
+from components_core.api.wialon_fleet import (
+    format_position,
+    get_fleet_positions,
+    get_fleet_resource_id,
+    get_positions_since,
+    is_fleet_state_live
+)
+
+LIVE_POSITIONS_CACHE_TTL = 120
 
 @frappe.whitelist()
-def get_live_positions(limit=100, resource_id=None):
+def get_live_positions(limit=None, resource_id=None):
     """Fetch live positions from Wialon API with batch processing and caching.
 
+    Fleet-wide requests are served from the live fleet state maintained by the
+    avl_evts poller while it is running. Otherwise positions come from a
+    per-resource stale-while-revalidate cache, so only one worker at a time
+    queries Wialon when an entry expires. While the circuit breaker is open
+    expired entries keep being served, and a fleet-wide request without any
+    cached entry falls back to the last positions the poller stored.
+
     Args:
-        limit (int): Maximum number of units to fetch (default: 100).
+        limit (int, optional): Maximum number of units to fetch (default: all).
         resource_id (int, optional): Filter units by resource ID.
 
     Returns:
         list: List of live unit positions.
     """
     try:
-        # Check for cached results first (reduces API load)
-        cache_key = f"wialon_live_positions_{resource_id or 'all'}"
-        cached_positions = frappe.cache().get_value(cache_key)
-
-        if cached_positions:
-            return cached_positions
-
-        # Retrieve valid session ID
-        session_id = get_valid_session()
-        if not session_id:
-            return {"error": "Failed to establish a valid Wialon session"}
-
-        # Construct API request parameters
-        spec = {
-            "itemsType": "avl_unit",
-            "propName": "sys_name",
-            "propValueMask": "*",
-            "sortType": "sys_name"
-        }
-
-        # Filter by resource ID if provided
-        if resource_id:
-            spec["propName"] = "rel_avl_resource_id"
-            spec["propValueMask"] = str(resource_id)
-
-        params = {
-            "svc": "core/search_items",
-            "params": json.dumps({
-                "spec": spec,
-                "force": 1,
-                "flags": 1025,
-                "from": 0,
-                "to": limit
-            }),
-            "sid": session_id
-        }
-
-        # Make API request
-        response = requests.post(WIALON_API_URL, data=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        # Handle errors
-        if "items" not in data:
-            return {"error": f"Failed to fetch live positions: {data.get('error', 'Unknown error')}"}
-
-        # Process API response
-        live_positions = []
-        for unit in data["items"]:
-            if "pos" in unit:
-                # Convert timestamp to readable format
-                last_updated = datetime.fromtimestamp(unit["pos"]["t"]).strftime("%Y-%m-%d %H:%M:%S")
-                live_positions.append({
-                    "unit_id": unit["id"],
-                    "name": unit["nm"],
-                    "latitude": unit["pos"]["y"],
-                    "longitude": unit["pos"]["x"],
-                    "speed": unit["pos"]["s"],
-                    "last_updated": last_updated
-                })
-
-        # Cache the results to reduce API load (valid for 2 minutes)
-        frappe.cache().set_value(cache_key, live_positions, expires_in_sec=120)
-
-        return live_positions
-
-    except requests.exceptions.RequestException as e:
+        if not resource_id and is_fleet_state_live():
+            positions = get_fleet_positions()
+        else:
+            # One cache shard per resource; limit is applied after the cache
+            positions = get_or_refresh(
+                f"wialon_live_positions_{resource_id or 'all'}",
+                LIVE_POSITIONS_CACHE_TTL,
+                lambda: fetch_live_positions(resource_id)
+            )
+
+        return positions[:int(limit)] if limit else positions
+
+    except WialonCircuitOpenError as e:
+        positions = [] if resource_id else get_fleet_positions()
+        if positions:
+            return positions[:int(limit)] if limit else positions
+        return {"error": f"Failed to fetch live positions: {str(e)}"}
+
+    except WialonAPIError as e:
         frappe.log_error(f"Error fetching Wialon live positions: {str(e)}", "Wialon API")
         return {"error": f"Failed to fetch live positions: {str(e)}"}
 
+def fetch_live_positions(resource_id=None):
+    """Query Wialon for the current position of every unit, optionally for one resource."""
+    # Construct API request parameters
+    spec = {
+        "itemsType": "avl_unit",
+        "propName": "sys_name",
+        "propValueMask": "*",
+        "sortType": "sys_name"
+    }
+
+    # Filter by resource ID if provided
+    if resource_id:
+        spec["propName"] = "rel_avl_resource_id"
+        spec["propValueMask"] = str(resource_id)
+
+    # Stream units page by page (basic properties + last position)
+    live_positions = []
+    for unit in get_client().iter_items(spec, 1025):
+        if "pos" in unit:
+            live_positions.append(format_position(unit["id"], unit["nm"], unit["pos"]))
+
+    # Pages arrive out of order; keep the sys_name ordering callers expect
+    live_positions.sort(key=lambda p: p["name"] or "")
+    return live_positions
+
+@frappe.whitelist()
+def get_live_positions_since(version=0, limit=None):
+    """Return only the units whose position changed after the client's last version.
+
+    Args:
+        version (int): Version returned by the previous call (0 on first call).
+        limit (int, optional): Maximum number of units when falling back to a full fetch.
+
+    Returns:
+        dict: ``{"version": int, "full": bool, "units": list, "resource_id": int}``.
+        When ``full`` is set, ``units`` is the whole fleet and replaces the
+        client's state. Realtime batches for another ``resource_id`` are not
+        part of this fleet.
+    """
+    if is_fleet_state_live():
+        return get_positions_since(version)
+
+    # Without the poller there is no change log, so every call is a full refresh
+    positions = get_live_positions(limit=limit)
+    if isinstance(positions, dict):
+        return positions
+    return {"version": 0, "full": True, "units": positions, "resource_id": None}
+
+@frappe.whitelist()
+def get_fleet_resource():
+    """Return the resource whose units the live fleet state holds, so pages can filter realtime batches."""
+    return get_fleet_resource_id()
 
 
 
@@ -1,48 +1,22 @@
 import frappe
-import requests
-import json
-from components_core.api.wialon_auth import get_valid_session
-
-WIALON_API_URL = "https://hst-api.wialon.com/wialon/ajax.html"
+from components_core.api.wialon_client import get_client, WialonAPIError
 
 @frappe.whitelist()
 def fetch_resources():
     """Fetch all resources available to the user from Wialon using an existing session."""
-    
-    session_id = get_valid_session()
-    if not session_id:
-        frappe.throw("Failed to obtain a valid Wialon session.")
-
-    # Fetch resources
-    params = {
-        "spec": {
-            "itemsType": "avl_resource",
-            "propName": "sys_name",
-            "propValueMask": "*",
-            "sortType": "sys_name"
-        },
-        "force": 1,
-        "flags": 1,  # Fetch basic info (name and ID)
-        "from": 0,
-        "to": 100  # Fetch up to 100 resources
+
+    spec = {
+        "itemsType": "avl_resource",
+        "propName": "sys_name",
+        "propValueMask": "*",
+        "sortType": "sys_name"
     }
 
     try:
-        response = requests.get(
-            WIALON_API_URL,
-            params={"svc": "core/search_items", "sid": session_id, "params": json.dumps(params)},
-            timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
-
-        if "error" in data:
-            frappe.log_error(f"Wialon API Error: {data['error']}", "Wialon Fetch Resources")
-            return {"error": f"Failed to fetch resources: {data['error']}"}
+        # Fetch basic info (name and ID) for every resource, page by page
+        return list(get_client().iter_items(spec, 1))
 
-        return data.get("items", [])
-
-    except requests.exceptions.RequestException as e:
+    except WialonAPIError as e:
         frappe.log_error(f"Error fetching Wialon resources: {str(e)}", "Wialon API")
         return {"error": f"Failed to fetch resources: {str(e)}"}
 
@@ -54,7 +28,6 @@ def fetch_resources():
 
 
 
-
 # import frappe
 # import requests
 # import json
@@ -30,7 +30,10 @@ scheduler_events = {
     "daily": ["components_core.tasks.daily_sync"],
     "hourly": ["components_core.tasks.hourly_check"],
     "weekly": ["components_core.tasks.weekly_cleanup"],
-    "monthly": ["components_core.tasks.monthly_report"]
+    "monthly": ["components_core.tasks.monthly_report"],
+    "cron": {
+        "* * * * *": ["components_core.tasks.start_position_poller"]
+    }
 }
 
 # Custom Permissions
@@ -0,0 +1,24 @@
+import frappe
+
+
+def execute():
+	"""Collapse duplicate Wialon Tracked Unit rows before unit_id becomes unique.
+
+	fetch_wialon_units used to insert a new row per unit on every sync. Keep the
+	most recently modified row for each unit_id and drop the rest.
+	"""
+	if not frappe.db.table_exists("Wialon Tracked Unit"):
+		return
+
+	# A unique index allows any number of NULLs but only one empty string
+	frappe.db.sql("update `tabWialon Tracked Unit` set unit_id = null where unit_id = ''")
+
+	frappe.db.sql(
+		"""
+		delete older from `tabWialon Tracked Unit` older
+		join `tabWialon Tracked Unit` newer
+			on newer.unit_id = older.unit_id
+			and (newer.modified > older.modified
+				or (newer.modified = older.modified and newer.name > older.name))
+		"""
+	)
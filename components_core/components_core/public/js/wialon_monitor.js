@@ -1,31 +1,91 @@
 frappe.pages['wialon_monitoring'].on_page_load = function(wrapper) {
     let map = L.map('map').setView([1.3047249, 103.7477816], 10);
-    
+
     L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png').addTo(map);
-    
+
     let markers = {};
+    let version = 0;
+    let resourceId = null;  // Resource of the fleet we show; batches for others are dropped
+    let syncing = false;
+
+    function updateMarker(unit) {
+        let latlng = [unit.latitude, unit.longitude];
+        let popup = `<b>${unit.name}</b><br>Speed: ${unit.speed} km/h`;
+
+        if (markers[unit.unit_id]) {
+            markers[unit.unit_id].setLatLng(latlng).setPopupContent(popup);
+        } else {
+            markers[unit.unit_id] = L.marker(latlng)
+                .bindPopup(popup)
+                .addTo(map);
+        }
+    }
+
+    function resync() {
+        if (syncing) {
+            return;
+        }
+        syncing = true;
 
-    function updateMarkers() {
         frappe.call({
-            method: "components_core.api.wialon_units.get_live_positions",
+            method: "components_core.api.wialon_units.get_live_positions_since",
+            args: { version: version },
             callback: function(response) {
-                if (response.message) {
-                    response.message.forEach(unit => {
-                        let latlng = [unit.latitude, unit.longitude];
-
-                        if (markers[unit.unit_id]) {
-                            markers[unit.unit_id].setLatLng(latlng);
-                        } else {
-                            markers[unit.unit_id] = L.marker(latlng)
-                                .bindPopup(`<b>${unit.name}</b><br>Speed: ${unit.speed} km/h`)
-                                .addTo(map);
+                let delta = response.message;
+                if (!delta || !delta.units) {
+                    return;
+                }
+
+                // A full snapshot replaces everything we have
+                if (delta.full) {
+                    let current = new Set(delta.units.map(unit => String(unit.unit_id)));
+                    Object.keys(markers).forEach(unit_id => {
+                        if (!current.has(unit_id)) {
+                            map.removeLayer(markers[unit_id]);
+                            delete markers[unit_id];
                         }
                     });
                 }
+
+                delta.units.forEach(updateMarker);
+                version = delta.version;
+                resourceId = delta.resource_id;
+            },
+            always: function() {
+                syncing = false;
             }
         });
     }
 
-    updateMarkers();
-    setInterval(updateMarkers, 5000);
+    // The position poller pushes every change batch; versions are consecutive,
+    // so a gap means we missed a batch and must catch up over HTTP
+    frappe.realtime.doctype_subscribe("Wialon Tracked Unit");
+    frappe.realtime.on("wialon_positions", function(batch) {
+        if (syncing || batch.version <= version) {
+            return;
+        }
+        // A full replace may switch resources; the resync picks up the new one
+        if (!batch.full && String(batch.resource_id) !== String(resourceId)) {
+            return;
+        }
+        if (batch.full || batch.version !== version + 1) {
+            resync();
+            return;
+        }
+
+        batch.units.forEach(([unit_id, name, latitude, longitude, speed, last_updated]) => {
+            updateMarker({ unit_id, name, latitude, longitude, speed, last_updated });
+        });
+        version = batch.version;
+    });
+    frappe.realtime.socket.on("connect", resync);
+
+    resync();
+
+    // Without a running poller nothing is pushed; fall back to a slow refresh
+    setInterval(() => {
+        if (!version) {
+            resync();
+        }
+    }, 60000);
 };
@@ -5,45 +5,106 @@ document.addEventListener("DOMContentLoaded", () => {
         attribution: '© OpenStreetMap'
     }).addTo(map);
 
-    fetchUnits(map);
-    setInterval(() => fetchUnits(map), 30000);  // Refresh every 30 seconds
+    const layer = L.layerGroup().addTo(map);
+
+    fetchUnits(map, layer);
+    map.on('moveend', () => fetchUnits(map, layer));
+
+    // Re-cluster when the position poller pushes changes inside the viewport,
+    // at most once per CLUSTER_REFRESH_MS. Batches for another resource than
+    // the fleet's are dropped; a full replace may switch the fleet's resource.
+    let resourceId = null;
+    frappe.call({
+        method: "components_core.api.wialon_units.get_fleet_resource",
+        callback: r => { resourceId = r.message; }
+    });
+
+    frappe.realtime.doctype_subscribe("Wialon Tracked Unit");
+    frappe.realtime.on("wialon_positions", batch => {
+        if (batch.full) {
+            resourceId = batch.resource_id;
+            scheduleFetch(map, layer);
+            return;
+        }
+        if (String(batch.resource_id) !== String(resourceId)) {
+            return;
+        }
+
+        const bounds = map.getBounds();
+        if (batch.units.some(([, , lat, lng]) => bounds.contains([lat, lng]))) {
+            scheduleFetch(map, layer);
+        }
+    });
 });
 
-function fetchUnits(map) {
+const CLUSTER_REFRESH_MS = 5000;
+let fetchTimer = null;
+
+function scheduleFetch(map, layer) {
+    if (fetchTimer) {
+        return;
+    }
+    fetchTimer = setTimeout(() => {
+        fetchTimer = null;
+        fetchUnits(map, layer);
+    }, CLUSTER_REFRESH_MS);
+}
+
+function fetchUnits(map, layer) {
+    // Clusters are computed on the server for the current viewport and zoom
+    const bounds = map.getBounds();
     frappe.call({
-        method: "components_core.api.wialon_fetch.fetch_wialon_units",
+        method: "components_core.api.wialon_spatial.get_clusters",
+        args: {
+            south: bounds.getSouth(),
+            west: bounds.getWest(),
+            north: bounds.getNorth(),
+            east: bounds.getEast(),
+            zoom: map.getZoom()
+        },
         callback: function(r) {
-            if (r.message.units) {
-                populateUnits(r.message.units, map);
+            if (r.message) {
+                populateUnits(r.message, map, layer);
             }
         }
     });
 }
 
-let markers = {};
-
-function populateUnits(units, map) {
+function populateUnits(markers, map, layer) {
     let unitList = document.getElementById('unitList');
     unitList.innerHTML = '';
+    layer.clearLayers();
 
-    units.forEach(unit => {
+    markers.forEach(marker => {
+        let latlng = [marker.latitude, marker.longitude];
         let li = document.createElement('li');
-        li.textContent = `${unit.name} (${unit.unit_id})`;
-        li.onclick = () => {
-            if(markers[unit.unit_id]){
-                map.setView(markers[unit.unit_id].getLatLng(), 15);
-                markers[unit.unit_id].openPopup();
-            }
-        };
-        unitList.appendChild(li);
 
-        if (markers[unit.unit_id]) {
-            markers[unit.unit_id].setLatLng([unit.latitude, unit.longitude]);
+        if (marker.count > 1) {
+            // Clicking a cluster zooms in until it splits
+            let zoomIn = () => map.setView(latlng, Math.min(map.getZoom() + 2, map.getMaxZoom()));
+            L.marker(latlng, {
+                icon: L.divIcon({
+                    className: 'wialon-cluster',
+                    html: `<div>${marker.count}</div>`,
+                    iconSize: [36, 36]
+                })
+            }).on('click', zoomIn).addTo(layer);
+
+            li.textContent = `${marker.count} units`;
+            li.onclick = zoomIn;
         } else {
-            markers[unit.unit_id] = L.marker([unit.latitude, unit.longitude])
-                .addTo(map)
-                .bindPopup(`<strong>${unit.name}</strong><br>ID: ${unit.unit_id}<br>Type: ${unit.unit_type}`);
+            let unitMarker = L.marker(latlng)
+                .addTo(layer)
+                .bindPopup(`<strong>${marker.name}</strong><br>ID: ${marker.unit_id}<br>Speed: ${marker.speed} km/h`);
+
+            li.textContent = `${marker.name} (${marker.unit_id})`;
+            li.onclick = () => {
+                map.setView(latlng, 15);
+                unitMarker.openPopup();
+            };
         }
+
+        unitList.appendChild(li);
     });
 }
 
@@ -0,0 +1,413 @@
+"""Local Wialon Remote API simulator for load and regression testing.
+
+Serves a synthetic fleet of moving units over the parts of the Remote API
+this app uses: token/login, core/check_session, core/search_items,
+core/update_data_flags, events/get, core/batch and avl_evts. Standard
+library only, so it runs without bench:
+
+    python -m components_core.simulator --units 50000 --resources 5 --port 8765
+
+and point a site at it:
+
+    bench --site mysite set-config wialon_api_url http://127.0.0.1:8765/wialon/ajax.html
+
+The fleet is derived from --seed, and positions and notification events are
+pure functions of time, so runs are repeatable and memory stays flat at 100k
+units. --latency, --error-rate, --http-error-rate and --slow-rate inject the
+failures the client has to cope with.
+
+Like the real API, core/search_items pages by item index and returns no
+stored messages, so the message ingestion (which sends a time range as
+from/to) gets no messages here either.
+"""
+import argparse
+import fnmatch
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+API_PATH = "/wialon/ajax.html"
+
+FIRST_RESOURCE_ID = 1000
+FIRST_UNIT_ID = 100000
+EVENT_CODES = [1001, 1002, 1003, 1004, 1005]  # Start, stop, geofence entry/exit, speed violation
+
+POSITION_INTERVAL = 30  # Seconds between position reports of one unit
+EVENT_INTERVAL = 3600  # Seconds between notification events of one unit
+
+# Wialon error codes returned by the simulator
+INVALID_SESSION = 1
+INVALID_SERVICE = 2
+INVALID_INPUT = 4
+REQUEST_ERROR = 5
+BAD_CREDENTIALS = 8
+
+# Search flags (core/search_items, core/update_data_flags)
+FLAG_BASE = 0x0001
+FLAG_POSITION = 0x0400
+
+
+class WialonError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class Fleet:
+    """Synthetic units, each driving in a circle around its own home point."""
+
+    def __init__(self, units=1000, resources=1, seed=1, first_unit_id=FIRST_UNIT_ID):
+        rng = random.Random(seed)
+        self.resource_ids = [FIRST_RESOURCE_ID + index for index in range(resources)]
+
+        self.units = []
+        self.by_offset = [[] for _ in range(POSITION_INTERVAL)]
+        for index in range(units):
+            unit = {
+                "id": first_unit_id + index,
+                "nm": f"SIM-{index:06d}",
+                "resource_id": self.resource_ids[index % resources],
+                "lat": rng.uniform(-35.0, 35.0),
+                "lon": rng.uniform(-120.0, 150.0),
+                "radius": rng.uniform(0.01, 0.2),  # Degrees
+                "period": rng.uniform(1800, 14400),  # Seconds per lap
+                "phase": rng.uniform(0, 2 * math.pi),
+                "offset": rng.randrange(POSITION_INTERVAL),
+                "event_offset": rng.randrange(EVENT_INTERVAL)
+            }
+            self.units.append(unit)
+            self.by_offset[unit["offset"]].append(unit)
+
+    def position(self, unit, t):
+        """Return the Wialon position object of a unit at Unix time ``t``."""
+        angle = unit["phase"] + 2 * math.pi * t / unit["period"]
+        speed = 2 * math.pi * unit["radius"] * 111 / unit["period"] * 3600  # km/h
+        return {
+            "t": int(t),
+            "y": round(unit["lat"] + unit["radius"] * math.sin(angle), 6),
+            "x": round(unit["lon"] + unit["radius"] * math.cos(angle), 6),
+            "z": 0,
+            "s": int(speed),
+            "c": int(math.degrees(angle + math.pi / 2)) % 360,
+            "sc": 8
+        }
+
+    def last_report(self, unit, t):
+        """Return the time of a unit's latest position report at or before ``t``."""
+        t = int(t)
+        return t - (t - unit["offset"]) % POSITION_INTERVAL
+
+    def match(self, prop_name, mask):
+        """Return the units matching a search spec's property and mask."""
+        if mask in ("*", ""):
+            return self.units
+
+        if prop_name == "rel_avl_resource_id":
+            return [unit for unit in self.units if str(unit["resource_id"]) == mask]
+
+        if prop_name == "sys_id":
+            return [unit for unit in self.units if fnmatch.fnmatchcase(str(unit["id"]), mask)]
+
+        return [unit for unit in self.units if fnmatch.fnmatchcase(unit["nm"], mask)]
+
+    def reported_between(self, after, until):
+        """Return the units that sent a position report in (after, until]."""
+        if until - after >= POSITION_INTERVAL:
+            return self.units
+
+        units = []
+        for second in range(int(after) + 1, int(until) + 1):
+            units.extend(self.by_offset[second % POSITION_INTERVAL])
+        return units
+
+    def events(self, resource_id, time_from, time_to, event_codes=None):
+        """Return the notification events of a resource's units in [time_from, time_to]."""
+        events = []
+        for index, unit in enumerate(self.units):
+            if unit["resource_id"] != resource_id:
+                continue
+
+            first = time_from + (unit["event_offset"] - time_from) % EVENT_INTERVAL
+            for t in range(first, time_to + 1, EVENT_INTERVAL):
+                code = EVENT_CODES[(t // EVENT_INTERVAL + index) % len(EVENT_CODES)]
+                if event_codes and code not in event_codes:
+                    continue
+                events.append({
+                    "id": EVENT_CODES.index(code) + 1,
+                    "resourceId": unit["id"],
+                    "time": t,
+                    "eventCode": code,
+                    "details": {"unit": unit["nm"], "pos": self.position(unit, t)}
+                })
+        return events
+
+
+class Simulator:
+    """Wialon API behaviour on top of a Fleet: sessions, services and fault injection."""
+
+    def __init__(self, fleet, token=None, latency=0.0, jitter=0.0, error_rate=0.0,
+            http_error_rate=0.0, slow_rate=0.0, slow_seconds=35.0, session_ttl=0, seed=None):
+        self.fleet = fleet
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.session_ttl = session_ttl
+        self.random = random.Random(seed)
+
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.services = {
+            "token/login": self.token_login,
+            "core/check_session": self.check_session,
+            "core/search_items": self.search_items,
+            "core/update_data_flags": self.update_data_flags,
+            "events/get": self.get_events,
+            "core/batch": self.batch
+        }
+
+    def handle(self, svc, params, sid):
+        """Return (HTTP status, response body) for one Remote API request."""
+        with self.lock:
+            self.requests += 1
+            error_roll, slow_roll = self.random.random(), self.random.random()
+            jitter = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0
+
+        delay = self.slow_seconds if slow_roll < self.slow_rate else self.latency + jitter
+        if delay > 0:
+            time.sleep(delay)
+
+        if error_roll < self.http_error_rate:
+            return 503, {"error": "Service Unavailable"}
+        if error_roll < self.http_error_rate + self.error_rate:
+            return 200, {"error": REQUEST_ERROR}
+
+        try:
+            if svc == "avl_evts":
+                return 200, self.avl_evts(sid)
+            return 200, self.call(svc, params, sid)
+        except WialonError as e:
+            return 200, {"error": e.code}
+
+    def call(self, svc, params, sid):
+        service = self.services.get(svc)
+        if service is None:
+            raise WialonError(INVALID_SERVICE)
+        if svc != "token/login":
+            self.check_sid(sid)
+        return service(params, sid)
+
+    def check_sid(self, sid):
+        session = self.sessions.get(sid)
+        if session is None:
+            raise WialonError(INVALID_SESSION)
+        if self.session_ttl and time.time() - session["created"] > self.session_ttl:
+            self.sessions.pop(sid, None)
+            raise WialonError(INVALID_SESSION)
+        return session
+
+    def token_login(self, params, sid):
+        token = params.get("token")
+        if not token or (self.token and token != self.token):
+            raise WialonError(BAD_CREDENTIALS)
+
+        sid = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[sid] = {"created": time.time(), "registered": False, "last_poll": 0}
+        return {"eid": sid, "user": {"id": 1, "nm": "simulator"}, "tm": int(time.time())}
+
+    def check_session(self, params, sid):
+        return {"user": {"id": 1, "nm": "simulator"}, "tm": int(time.time())}
+
+    def search_items(self, params, sid):
+        spec = params.get("spec") or {}
+        flags = int(params.get("flags", FLAG_BASE))
+        index_from, index_to = int(params.get("from", 0)), int(params.get("to", 0))
+        now = time.time()
+
+        if spec.get("itemsType") == "avl_resource":
+            items = [{"id": resource_id, "nm": f"Resource {resource_id}"} for resource_id in self.fleet.resource_ids]
+        elif spec.get("itemsType") == "avl_unit":
+            units = self.fleet.match(spec.get("propName"), str(spec.get("propValueMask", "*")))
+            items = [self.unit_item(unit, flags, now) for unit in units]
+        else:
+            raise WialonError(INVALID_INPUT)
+
+        total = len(items)
+        end = total if index_to == 0 else min(index_to + 1, total)
+        return {
+            "searchSpec": spec,
+            "dataFlags": flags,
+            "totalItemsCount": total,
+            "indexFrom": index_from,
+            "indexTo": end - 1,
+            "items": items[index_from:end]
+        }
+
+    def unit_item(self, unit, flags, now):
+        item = {"id": unit["id"], "nm": unit["nm"], "cls": 2}
+        if flags & FLAG_POSITION:
+            item["pos"] = self.fleet.position(unit, self.fleet.last_report(unit, now))
+        return item
+
+    def update_data_flags(self, params, sid):
+        now = time.time()
+        session = self.check_sid(sid)
+        session["registered"] = True
+        session["last_poll"] = int(now)
+
+        flags = FLAG_BASE | FLAG_POSITION
+        for spec in params.get("spec") or []:
+            flags = int(spec.get("flags", flags))
+        return [{"i": unit["id"], "d": self.unit_item(unit, flags, now), "f": flags} for unit in self.fleet.units]
+
+    def get_events(self, params, sid):
+        resource_id = int(params.get("resourceId", 0))
+        time_from, time_to = int(params.get("timeFrom", 0)), min(int(params.get("timeTo", 0)), int(time.time()))
+        event_codes = params.get("eventCode")
+        if isinstance(event_codes, int):
+            event_codes = [event_codes]
+        return {"events": self.fleet.events(resource_id, time_from, time_to, event_codes)}
+
+    def batch(self, params, sid):
+        results = []
+        for request in params.get("params") or []:
+            try:
+                results.append(self.call(request.get("svc"), request.get("params") or {}, sid))
+            except WialonError as e:
+                results.append({"error": e.code})
+        return results
+
+    def avl_evts(self, sid):
+        session = self.check_sid(sid)
+        now = int(time.time())
+        if not session["registered"]:
+            return {"tm": now, "events": []}
+
+        after, session["last_poll"] = session["last_poll"], now
+        events = [
+            {"i": unit["id"], "t": "m", "d": {"pos": self.fleet.position(unit, self.fleet.last_report(unit, now))}}
+            for unit in self.fleet.reported_between(after, now)
+        ]
+        return {"tm": now, "events": events}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API behind the pooled client
+    simulator = None
+    verbose = False
+
+    def do_GET(self):
+        self.respond(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode()) if length else {}
+        form.update(parse_qs(urlparse(self.path).query))
+        self.respond(form)
+
+    def respond(self, form):
+        path = urlparse(self.path).path
+        sid = (form.get("sid") or [None])[0]
+
+        if path.endswith("/avl_evts"):
+            svc, params = "avl_evts", {}
+        else:
+            svc = (form.get("svc") or [""])[0]
+            try:
+                params = json.loads((form.get("params") or ["{}"])[0])
+            except ValueError:
+                svc, params = None, {}
+
+        if svc is None:
+            status, body = 200, {"error": INVALID_INPUT}
+        else:
+            status, body = self.simulator.handle(svc, params, sid)
+
+        payload = json.dumps(body, separators=(",", ":")).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def start_simulator(host=DEFAULT_HOST, port=0, units=1000, resources=1, seed=1, verbose=False,
+        first_unit_id=FIRST_UNIT_ID, **options):
+    """Start a simulator on a background thread and return (server, api_url).
+
+    Port 0 picks a free port. Stop it with ``server.shutdown()``. Units are
+    numbered from ``first_unit_id``. Remaining keyword arguments are passed
+    to Simulator.
+    """
+    handler = type("SimulatorHandler", (RequestHandler,), {
+        "simulator": Simulator(Fleet(units, resources, seed, first_unit_id), seed=seed, **options),
+        "verbose": verbose
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="wialon-simulator", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{API_PATH}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Wialon Remote API simulator")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--units", type=int, default=1000, help="Number of simulated units")
+    parser.add_argument("--resources", type=int, default=1, help="Resources the units are spread over")
+    parser.add_argument("--first-unit-id", type=int, default=FIRST_UNIT_ID, help="ID of the first simulated unit")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the fleet and fault injection")
+    parser.add_argument("--token", help="Only accept this token (default: any)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with Wialon error 5")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests delayed by --slow-seconds")
+    parser.add_argument("--slow-seconds", type=float, default=35.0)
+    parser.add_argument("--session-ttl", type=int, default=0, help="Expire sessions after this many seconds (0: never)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+
+    server, url = start_simulator(
+        host=args.host,
+        port=args.port,
+        units=args.units,
+        resources=args.resources,
+        seed=args.seed,
+        verbose=args.verbose,
+        first_unit_id=args.first_unit_id,
+        token=args.token,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        http_error_rate=args.http_error_rate,
+        slow_rate=args.slow_rate,
+        slow_seconds=args.slow_seconds,
+        session_ttl=args.session_ttl
+    )
+    print(f"Simulating {args.units} units on {args.resources} resource(s) at {url}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
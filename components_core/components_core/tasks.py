@@ -1,23 +1,39 @@
 # File: components_core/tasks.py
 
 import frappe
+from components_core.api.wialon_lock import run_lock
 
+@run_lock("components_core_sync_all")
 def sync_all():
     """Placeholder function for syncing all data"""
     frappe.logger().info("Running sync_all task...")
 
+@run_lock("components_core_daily_sync")
 def daily_sync():
     """Placeholder function for daily data sync"""
     frappe.logger().info("Running daily_sync task...")
 
+@run_lock("components_core_hourly_check")
 def hourly_check():
     """Placeholder function for hourly data check"""
     frappe.logger().info("Running hourly_check task...")
 
+@run_lock("components_core_weekly_cleanup")
 def weekly_cleanup():
     """Placeholder function for weekly cleanup"""
     frappe.logger().info("Running weekly_cleanup task...")
 
+@run_lock("components_core_monthly_report")
 def monthly_report():
     """Placeholder function for monthly report generation"""
     frappe.logger().info("Running monthly_report task...")
+
+def start_position_poller():
+    """Start the avl_evts position poller unless one is already queued or running"""
+    frappe.enqueue(
+        "components_core.api.wialon_events.poll_positions",
+        queue="long",
+        timeout=300,
+        job_id="wialon_position_poller",
+        deduplicate=True
+    )
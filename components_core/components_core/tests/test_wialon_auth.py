@@ -0,0 +1,92 @@
+# Copyright (c) 2025, Ben and Contributors
+# See license.txt
+
+import frappe
+import threading
+import time
+from unittest.mock import call, patch
+from frappe.tests.utils import FrappeTestCase
+from components_core.api.wialon_auth import SESSION_LOCK_KEY, _clear_shared_session, _refresh_single_flight, refresh_session
+from components_core.api.wialon_config import DEFAULT_ACCOUNT
+
+
+class ConfigurationDoc(frappe._dict):
+	def get_doc_before_save(self):
+		return self.before
+
+
+def make_config(api_token="token-default", resource_id="", accounts=(), before=None):
+	return ConfigurationDoc(
+		api_token=api_token,
+		resource_id=resource_id,
+		accounts=[frappe._dict(row) for row in accounts],
+		before=before
+	)
+
+
+def make_account(name, api_token, resource_ids="", enabled=1):
+	return {"name": name, "api_token": api_token, "resource_ids": resource_ids, "enabled": enabled}
+
+
+@patch("components_core.api.wialon_auth.clear_config_cache")
+@patch("components_core.api.wialon_auth._schedule_refresh")
+@patch("components_core.api.wialon_auth._clear_shared_session")
+class TestRefreshSession(FrappeTestCase):
+	def test_only_changed_accounts_log_in_again(self, clear_session, schedule_refresh, clear_config):
+		before = make_config(accounts=[make_account("a", "token-a"), make_account("b", "token-b", "1, 2")])
+		doc = make_config(accounts=[make_account("a", "token-a"), make_account("b", "token-b", "1, 2, 3")], before=before)
+
+		refresh_session(doc)
+
+		clear_config.assert_called_once()
+		clear_session.assert_called_once_with("b")
+		schedule_refresh.assert_called_once_with("b", enqueue_after_commit=True)
+
+	def test_unchanged_save_keeps_every_session(self, clear_session, schedule_refresh, clear_config):
+		accounts = [make_account("a", "token-a", "1\n2")]
+		refresh_session(make_config(accounts=accounts, before=make_config(accounts=accounts)))
+
+		clear_session.assert_not_called()
+		schedule_refresh.assert_not_called()
+
+	def test_removed_and_disabled_accounts_drop_their_sessions(self, clear_session, schedule_refresh, clear_config):
+		before = make_config(accounts=[make_account("a", "token-a"), make_account("b", "token-b")])
+		doc = make_config(accounts=[make_account("b", "token-b", enabled=0)], before=before)
+
+		refresh_session(doc)
+
+		self.assertEqual(sorted(clear_session.call_args_list), [call("a"), call("b")])
+		schedule_refresh.assert_not_called()
+
+	def test_default_account_token_change(self, clear_session, schedule_refresh, clear_config):
+		refresh_session(make_config(api_token="token-new", before=make_config()))
+
+		clear_session.assert_called_once_with(DEFAULT_ACCOUNT)
+		schedule_refresh.assert_called_once_with(DEFAULT_ACCOUNT, enqueue_after_commit=True)
+
+	def test_first_save_logs_every_account_in(self, clear_session, schedule_refresh, clear_config):
+		refresh_session(make_config(accounts=[make_account("a", "token-a")]))
+
+		self.assertEqual(
+			sorted(schedule_refresh.call_args_list),
+			sorted([call(DEFAULT_ACCOUNT, enqueue_after_commit=True), call("a", enqueue_after_commit=True)])
+		)
+
+
+class TestRefreshSingleFlight(FrappeTestCase):
+	def setUp(self):
+		self.account = f"test-{frappe.generate_hash(length=8)}"
+		_clear_shared_session(self.account)
+
+	def test_waiters_stop_when_the_winner_fails(self):
+		cache = frappe.cache()
+		winner = cache.lock(cache.make_key(f"{SESSION_LOCK_KEY}|{self.account}"), timeout=30, thread_local=False)
+		self.assertTrue(winner.acquire(blocking=False))
+		# The winner's token/login fails: it releases the lock without storing a session
+		threading.Timer(0.3, winner.release).start()
+
+		started = time.monotonic()
+		result = _refresh_single_flight(account=self.account)
+
+		self.assertIn("error", result)
+		self.assertLess(time.monotonic() - started, 2)
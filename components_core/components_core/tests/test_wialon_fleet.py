@@ -0,0 +1,75 @@
+# Copyright (c) 2025, Ben and Contributors
+# See license.txt
+
+import frappe
+from unittest.mock import patch
+from frappe.tests.utils import FrappeTestCase
+from components_core.api.wialon_fleet import (
+	FLEET_CHANGES_KEY,
+	apply_position_updates,
+	format_position,
+	get_fleet_version,
+	get_positions_since,
+	replace_fleet_state
+)
+
+TIME = 1767225600
+
+
+def make_update(x, y, name=None):
+	update = {"pos": {"x": x, "y": y, "s": 10, "t": TIME}}
+	if name:
+		update["nm"] = name
+	return update
+
+
+@patch("components_core.api.wialon_fleet.publish_fleet_changes")
+class TestFleetVersions(FrappeTestCase):
+	def setUp(self):
+		with patch("components_core.api.wialon_fleet.publish_fleet_changes"):
+			replace_fleet_state([
+				format_position(1, "a", make_update(1, 1)["pos"]),
+				format_position(2, "b", make_update(2, 2)["pos"])
+			])
+		self.version = get_fleet_version()
+
+	def test_delta_holds_only_changed_units(self, publish):
+		changed = apply_position_updates({1: make_update(1, 1), 2: make_update(3, 3)})
+
+		self.assertEqual([p["unit_id"] for p in changed], [2])
+		delta = get_positions_since(self.version)
+		self.assertEqual(delta["version"], self.version + 1)
+		self.assertFalse(delta["full"])
+		self.assertEqual([(p["unit_id"], p["latitude"]) for p in delta["units"]], [(2, 3)])
+		publish.assert_called_once_with(self.version + 1, changed, resource_id=None)
+
+	def test_change_log_matches_the_published_version(self, publish):
+		apply_position_updates({1: make_update(5, 5)})
+		apply_position_updates({2: make_update(6, 6)})
+
+		cache = frappe.cache()
+		scores = dict(cache.zrange(cache.make_key(FLEET_CHANGES_KEY), 0, -1, withscores=True))
+		self.assertEqual(scores, {b"1": self.version + 1, b"2": self.version + 2})
+		self.assertEqual(get_fleet_version(), self.version + 2)
+
+	def test_client_older_than_a_replace_gets_a_snapshot(self, publish):
+		replace_fleet_state([format_position(3, "c", make_update(4, 4)["pos"])])
+
+		delta = get_positions_since(self.version)
+		self.assertTrue(delta["full"])
+		self.assertEqual([p["unit_id"] for p in delta["units"]], [3])
+
+	def test_deltas_carry_the_fleet_resource(self, publish):
+		replace_fleet_state([format_position(3, "c", make_update(4, 4)["pos"])], resource_id=42)
+		version = get_fleet_version()
+		apply_position_updates({3: make_update(5, 5)}, resource_id=42)
+
+		self.assertEqual(get_positions_since(version)["resource_id"], 42)
+		self.assertEqual(get_positions_since(0)["resource_id"], 42)
+		publish.assert_called_with(version + 1, [format_position(3, "c", make_update(5, 5)["pos"])], resource_id=42)
+
+	def test_bad_version_gets_a_snapshot(self, publish):
+		for version in ("not-a-version", None, -1, self.version + 10):
+			delta = get_positions_since(version)
+			self.assertTrue(delta["full"])
+			self.assertEqual(len(delta["units"]), 2)
@@ -0,0 +1,122 @@
+# Copyright (c) 2025, Ben and Contributors
+# See license.txt
+
+import frappe
+import threading
+import time
+from unittest.mock import patch
+from frappe.tests.utils import FrappeTestCase
+from components_core.api.wialon_client import WialonCircuitOpenError, WialonRateLimitError
+from components_core.api.wialon_limiter import (
+	CIRCUIT_FAILURE_THRESHOLD,
+	CIRCUIT_KEY,
+	INTERACTIVE,
+	RATE_BURST_CONFIG,
+	RATE_LIMIT_CONFIG,
+	SCHEDULED,
+	CallGuard,
+	is_circuit_open
+)
+from components_core.api.wialon_log import LOG_LEVEL_CONFIG
+
+
+class TestCallGuard(FrappeTestCase):
+	def setUp(self):
+		self.cache = frappe.cache()
+		self.account = f"test_{frappe.generate_hash(length=8)}"
+		self.clear_circuit()
+		self.addCleanup(self.clear_circuit)
+
+	def clear_circuit(self):
+		self.cache.delete(*(self.cache.make_key(f"{CIRCUIT_KEY}|{suffix}") for suffix in ("open", "half_open", "probe", "failures")))
+
+	def make_guard(self, priority=SCHEDULED, rate=0.01, burst=10, max_wait=0, **conf):
+		with patch.dict(frappe.conf, {RATE_LIMIT_CONFIG: rate, RATE_BURST_CONFIG: burst, **conf}):
+			guard = CallGuard(self.account, priority)
+		guard.max_wait = max_wait
+		return guard
+
+	def open_circuit(self, guard):
+		for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+			guard.record_failure(False, "core/search_items")
+
+	def test_burst_then_rate_limited(self):
+		guard = self.make_guard(priority=INTERACTIVE, burst=3)
+
+		for _ in range(3):
+			self.assertFalse(guard.admit("core/search_items"))
+		self.assertRaises(WialonRateLimitError, guard.admit, "core/search_items")
+
+	def test_waits_for_refill(self):
+		guard = self.make_guard(priority=INTERACTIVE, rate=20, burst=1, max_wait=2)
+		guard.admit("core/search_items")
+
+		started = time.monotonic()
+		guard.admit("core/search_items")
+		self.assertGreater(time.monotonic() - started, 0.02)
+
+	def test_reserve_is_kept_for_higher_priorities(self):
+		scheduled = self.make_guard(SCHEDULED, burst=10)
+		interactive = self.make_guard(INTERACTIVE, burst=10)
+
+		# SCHEDULED leaves 20% of the burst
+		for _ in range(8):
+			scheduled.admit("events/get")
+		self.assertRaises(WialonRateLimitError, scheduled.admit, "events/get")
+
+		for _ in range(2):
+			interactive.admit("core/search_items")
+		self.assertRaises(WialonRateLimitError, interactive.admit, "core/search_items")
+
+	def test_circuit_opens_at_threshold(self):
+		guard = self.make_guard()
+		for _ in range(CIRCUIT_FAILURE_THRESHOLD - 1):
+			guard.record_failure(False, "core/search_items")
+		self.assertFalse(is_circuit_open())
+
+		guard.record_failure(False, "core/search_items")
+		self.assertTrue(is_circuit_open())
+		self.assertRaises(WialonCircuitOpenError, guard.admit, "core/search_items")
+
+	def test_single_probe_closes_the_circuit(self):
+		guard = self.make_guard()
+		self.open_circuit(guard)
+		self.cache.delete(self.cache.make_key(f"{CIRCUIT_KEY}|open"))  # The open period is over
+
+		self.assertTrue(guard.admit("core/search_items"))
+		self.assertRaises(WialonCircuitOpenError, guard.admit, "core/search_items")
+
+		guard.record_success(True)
+		self.assertFalse(guard.admit("core/search_items"))
+
+	def test_failed_probe_reopens_the_circuit(self):
+		guard = self.make_guard()
+		self.open_circuit(guard)
+		self.cache.delete(self.cache.make_key(f"{CIRCUIT_KEY}|open"))
+
+		probe = guard.admit("core/search_items")
+		guard.record_failure(probe, "core/search_items")
+		self.assertTrue(is_circuit_open())
+
+	def test_guard_works_on_threads_without_frappe_local(self):
+		# Log everything, so the limiter's log records are written from the thread too
+		guard = self.make_guard(priority=INTERACTIVE, burst=1, **{LOG_LEVEL_CONFIG: "DEBUG"})
+		errors = []
+
+		def call():
+			try:
+				guard.admit("core/search_items")
+				guard.admit("core/search_items")
+			except Exception as e:
+				errors.append(e)
+			try:
+				self.open_circuit(guard)
+				guard.admit("core/search_items")
+			except Exception as e:
+				errors.append(e)
+
+		thread = threading.Thread(target=call)
+		thread.start()
+		thread.join()
+
+		self.assertEqual([type(e) for e in errors], [WialonRateLimitError, WialonCircuitOpenError])
@@ -0,0 +1,71 @@
+# Copyright (c) 2025, Ben and Contributors
+# See license.txt
+
+import frappe
+import time
+from frappe.tests.utils import FrappeTestCase
+from components_core.api.wialon_lock import LeaseLock, get_skipped_runs, run_lock
+
+
+class TestLeaseLock(FrappeTestCase):
+	def setUp(self):
+		self.cache = frappe.cache()
+		self.name = f"test_lock_{frappe.generate_hash(length=8)}"
+
+	def test_second_holder_is_refused_until_release(self):
+		with LeaseLock(self.name) as first:
+			self.assertTrue(first.acquired)
+			with LeaseLock(self.name) as second:
+				self.assertFalse(second.acquired)
+
+		with LeaseLock(self.name) as third:
+			self.assertTrue(third.acquired)
+		self.assertIsNone(self.cache.get(third.key))
+
+	def test_release_keeps_a_lock_taken_over_by_another_run(self):
+		lock = LeaseLock(self.name)
+		lock.acquire()
+		self.cache.set(lock.key, "other-token", ex=60)
+
+		lock.release()
+		self.assertEqual(self.cache.get(lock.key), b"other-token")
+		self.cache.delete(lock.key)
+
+	def test_heartbeat_renews_the_lease(self):
+		with LeaseLock(self.name, lease=3) as lock:
+			time.sleep(2.5)
+			# Two renewals at 1 s and 2 s; without them under a second would be left
+			self.assertGreaterEqual(self.cache.ttl(lock.key), 2)
+			self.assertFalse(lock.lost)
+
+	def test_heartbeat_reports_a_lost_lease(self):
+		lock = LeaseLock(self.name, lease=3)
+		lock.acquire()
+		self.cache.set(lock.key, "other-token", ex=60)
+		time.sleep(1.5)
+
+		lock.release()
+		self.assertTrue(lock.lost)
+		self.assertEqual(self.cache.get(lock.key), b"other-token")
+		self.cache.delete(lock.key)
+
+
+class TestRunLock(FrappeTestCase):
+	def test_overlapping_run_is_skipped_and_counted(self):
+		shard = frappe.generate_hash(length=8)
+		lock_name = f"test_run_{shard}"
+		calls = []
+
+		@run_lock("test_run_{shard}")
+		def task(shard, nested=False):
+			calls.append(shard)
+			if nested:
+				self.assertIsNone(task(shard))
+			return "done"
+
+		self.assertEqual(task(shard, nested=True), "done")
+		self.assertEqual(calls, [shard])
+		self.assertEqual(get_skipped_runs().get(lock_name), 1)
+
+		# Another shard has its own lock
+		self.assertEqual(task(f"{shard}-2"), "done")
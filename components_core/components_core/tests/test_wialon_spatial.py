@@ -0,0 +1,179 @@
+# Copyright (c) 2025, Ben and Contributors
+# See license.txt
+
+from unittest.mock import patch
+from frappe.tests.utils import FrappeTestCase
+from components_core.api.wialon_spatial import ClusterIndex, FleetGrid, FleetIndex, haversine
+
+
+def make_position(unit_id, latitude, longitude):
+	return {"unit_id": str(unit_id), "latitude": latitude, "longitude": longitude}
+
+
+def unit_ids(positions):
+	return sorted(position["unit_id"] for position in positions)
+
+
+def rounded(clusters):
+	# Sums may be added up in another order, so compare centres to the micro-degree
+	return sorted(
+		(cluster["count"], round(cluster["latitude"], 6), round(cluster["longitude"], 6), cluster.get("unit_id"))
+		for cluster in clusters
+	)
+
+
+class TestFleetGrid(FrappeTestCase):
+	def setUp(self):
+		self.grid = FleetGrid()
+		for position in (
+			make_position(1, 52.52, 13.40),  # Berlin
+			make_position(2, 52.53, 13.41),
+			make_position(3, 48.85, 2.35),  # Paris
+			make_position(4, -17.70, 179.95),  # Fiji, east of the antimeridian
+			make_position(5, -17.80, -179.95)
+		):
+			self.grid.upsert(position)
+
+	def test_bbox(self):
+		self.assertEqual(unit_ids(self.grid.in_bbox(52, 13, 53, 14)), ["1", "2"])
+		self.assertEqual(unit_ids(self.grid.in_bbox(40, -10, 60, 20)), ["1", "2", "3"])
+		self.assertEqual(self.grid.in_bbox(0, 0, 1, 1), [])
+
+	def test_bbox_across_antimeridian(self):
+		self.assertEqual(unit_ids(self.grid.in_bbox(-18, 179, -17, -179)), ["4", "5"])
+
+	def test_bbox_with_wrapped_longitudes(self):
+		# Leaflet after panning one world east, and one world west
+		self.assertEqual(unit_ids(self.grid.in_bbox(52, 373, 53, 374)), ["1", "2"])
+		self.assertEqual(unit_ids(self.grid.in_bbox(52, -347, 53, -346)), ["1", "2"])
+		self.assertEqual(unit_ids(self.grid.in_bbox(-18, 179, -17, 181)), ["4", "5"])
+		self.assertEqual(len(self.grid.in_bbox(-90, -400, 90, 400)), 5)
+
+	def test_move_between_cells(self):
+		self.grid.upsert(make_position(1, 48.86, 2.36))
+
+		self.assertEqual(unit_ids(self.grid.in_bbox(52, 13, 53, 14)), ["2"])
+		self.assertEqual(unit_ids(self.grid.in_bbox(48, 2, 49, 3)), ["1", "3"])
+		self.assertEqual(len(self.grid), 5)
+		self.assertEqual(sum(len(units) for units in self.grid.cells.values()), 5)
+
+	def test_within_radius(self):
+		results = self.grid.within_radius(52.52, 13.40, 5000)
+
+		self.assertEqual([position["unit_id"] for position in results], ["1", "2"])
+		self.assertEqual(results[0]["distance_m"], 0)
+		self.assertAlmostEqual(results[1]["distance_m"], haversine(52.52, 13.40, 52.53, 13.41), delta=0.1)
+
+	def test_within_radius_across_antimeridian(self):
+		self.assertEqual(unit_ids(self.grid.within_radius(-17.75, 180, 20000)), ["4", "5"])
+
+
+class TestClusterIndex(FrappeTestCase):
+	def setUp(self):
+		self.positions = [make_position(n, 52.5 + n * 0.0001, 13.4) for n in range(10)]
+		self.positions.append(make_position(100, 48.85, 2.35))
+		self.index = ClusterIndex(self.positions)
+
+	def test_counts_add_up_at_every_zoom(self):
+		for zoom in range(17):
+			clusters = self.index.clusters(zoom, -85, -180, 85, 180)
+			self.assertEqual(sum(cluster["count"] for cluster in clusters), len(self.positions), zoom)
+
+	def test_low_zoom_merges_nearby_units(self):
+		clusters = sorted(self.index.clusters(5, -85, -180, 85, 180), key=lambda cluster: cluster["count"])
+
+		self.assertEqual([cluster["count"] for cluster in clusters], [1, 10])
+		self.assertEqual(clusters[0]["unit_id"], "100")
+		self.assertAlmostEqual(clusters[1]["latitude"], 52.50045, places=6)
+
+	def test_viewport_filters_clusters(self):
+		clusters = self.index.clusters(5, 45, 0, 50, 5)
+		self.assertEqual([cluster.get("unit_id") for cluster in clusters], ["100"])
+
+	def test_update_matches_a_rebuild(self):
+		for zoom in range(17):
+			self.index.clusters(zoom, -85, -180, 85, 180)
+
+		moves = [
+			make_position(0, 48.8501, 2.3501),  # Joins unit 100 in Paris
+			make_position(1, 52.5001, 13.4),  # Moves within its cell
+			make_position(200, -33.86, 151.21)  # New unit in Sydney
+		]
+		self.index.update(moves)
+
+		positions = {position["unit_id"]: position for position in self.positions + moves}
+		rebuilt = ClusterIndex(list(positions.values()))
+		for zoom in range(17):
+			self.assertEqual(
+				rounded(self.index.clusters(zoom, -85, -180, 85, 180)),
+				rounded(rebuilt.clusters(zoom, -85, -180, 85, 180)),
+				zoom
+			)
+		self.assertEqual(self.index.clusters(16, -34, 151, -33, 152), [dict(moves[2], count=1)])
+
+
+@patch("components_core.api.wialon_spatial.get_positions_since")
+@patch("components_core.api.wialon_spatial.get_live_positions")
+@patch("components_core.api.wialon_spatial.is_fleet_state_live")
+class TestFleetIndex(FrappeTestCase):
+	def test_without_poller_loads_live_positions(self, is_live, get_live_positions, get_positions_since):
+		is_live.return_value = False
+		get_live_positions.return_value = [make_position(1, 52.52, 13.40), make_position(3, 48.85, 2.35)]
+
+		index = FleetIndex()
+		index.sync()
+
+		self.assertEqual(unit_ids(index.grid.in_bbox(40, -10, 60, 20)), ["1", "3"])
+		get_positions_since.assert_not_called()
+
+	def test_reloads_at_most_every_interval(self, is_live, get_live_positions, get_positions_since):
+		is_live.return_value = False
+		get_live_positions.return_value = []
+
+		index = FleetIndex()
+		index.sync()
+		index.synced_at = 0
+		index.sync()
+
+		get_live_positions.assert_called_once()
+
+	def test_error_keeps_the_loaded_units(self, is_live, get_live_positions, get_positions_since):
+		is_live.return_value = False
+		get_live_positions.return_value = [make_position(1, 52.52, 13.40)]
+		index = FleetIndex()
+		index.sync()
+
+		get_live_positions.return_value = {"error": "Failed to fetch live positions"}
+		index.synced_at = index.reloaded_at = 0
+		index.sync()
+
+		self.assertEqual(len(index.grid), 1)
+
+	def test_poller_start_replaces_loaded_units(self, is_live, get_live_positions, get_positions_since):
+		is_live.return_value = False
+		get_live_positions.return_value = [make_position(1, 52.52, 13.40)]
+		index = FleetIndex()
+		index.sync()
+
+		is_live.return_value = True
+		get_positions_since.return_value = {"version": 7, "full": True, "units": [make_position(3, 48.85, 2.35)]}
+		index.synced_at = 0
+		index.sync()
+
+		get_positions_since.assert_called_once_with(0)
+		self.assertEqual(unit_ids(index.grid.in_bbox(-90, -180, 90, 180)), ["3"])
+		self.assertEqual(index.version, 7)
+
+	def test_deltas_update_the_cluster_index_in_place(self, is_live, get_live_positions, get_positions_since):
+		is_live.return_value = True
+		get_positions_since.return_value = {"version": 1, "full": True, "units": [make_position(1, 52.52, 13.40)]}
+		index = FleetIndex()
+		index.sync()
+		cluster_index = index.clusters()
+
+		get_positions_since.return_value = {"version": 2, "full": False, "units": [make_position(1, 48.85, 2.35)]}
+		index.synced_at = 0
+		index.sync()
+
+		self.assertIs(index.clusters(), cluster_index)
+		self.assertEqual(index.clusters().clusters(10, 48, 2, 49, 3)[0]["unit_id"], "1")
@@ -0,0 +1,228 @@
+import frappe
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from frappe.utils import cint, format_duration
+from components_core.api.wialon_auth import get_session_id, invalidate_session
+from components_core.api.wialon_client import get_client, WialonAPIError, INVALID_SESSION
+from components_core.api.wialon_limiter import BACKFILL, get_guard
+from components_core.api.wialon_lock import run_lock
+from components_core.api.wialon_log import get_logger
+from wialon_notifications.api.wialon_cursor import CURSOR_DOCTYPE, MESSAGES, NOTIFICATIONS, get_cursor_name
+from wialon_notifications.api.wialon_notifications import (
+    flush_unit_updates,
+    get_notification_params,
+    get_resource_account,
+    get_resource_id,
+    process_notifications
+)
+
+# Historical backfill: the range is split into fixed windows fetched by up to
+# `concurrency` threads, each written through the bulk writers as soon as it
+# arrives. The cursor's backfill_watermark marks the end of the contiguous run
+# of finished windows, so a killed job resumes from there.
+#
+# Messages are not backfilled: get_message_params sends Unix times as the
+# core/search_items from/to, which Wialon reads as item indexes, so every
+# window would come back empty while the checkpoint still advanced to the end.
+BACKFILL_WINDOWS = {
+    NOTIFICATIONS: 24 * 3600
+}
+BACKFILL_CONCURRENCY = 4
+BACKFILL_MAX_CONCURRENCY = 16
+BACKFILL_DEFAULT_DAYS = 3 * 365
+BACKFILL_JOB_TIMEOUT = 6 * 3600
+BACKFILL_SESSION_RETRIES = 3
+PROGRESS_INTERVAL = 2  # Seconds between progress updates
+
+backfill_log = get_logger("backfill")
+
+@frappe.whitelist()
+def start_backfill(stream, time_from=None, time_to=None, window_size=None, concurrency=None, resource_id=None):
+    """Start a backfill of one stream over a time range, replacing any unfinished one.
+
+    Args:
+        stream (str): "Notifications"; messages cannot be backfilled yet.
+        time_from (int, optional): Range start, Unix time (default: BACKFILL_DEFAULT_DAYS ago).
+        time_to (int, optional): Range end, Unix time (default: now).
+        window_size (int, optional): Seconds per fetched window (default per stream).
+        concurrency (int, optional): Windows fetched in parallel (default: BACKFILL_CONCURRENCY).
+        resource_id (str, optional): Resource to backfill (default: the default account's).
+    """
+    frappe.only_for("System Manager")
+    if stream == MESSAGES:
+        frappe.throw("Messages cannot be backfilled: Wialon does not return messages by time range through core/search_items")
+    if stream not in BACKFILL_WINDOWS:
+        frappe.throw(f"Unknown stream {stream}")
+
+    resource_id = resource_id or get_resource_id()
+    now = int(time.time())
+    time_to = cint(time_to) or now
+    time_from = cint(time_from) if time_from is not None else now - BACKFILL_DEFAULT_DAYS * 86400
+    if time_from > time_to:
+        frappe.throw("Backfill start must be before its end")
+
+    frappe.db.set_value(CURSOR_DOCTYPE, _ensure_cursor(resource_id, stream), {
+        "backfill_start": time_from,
+        "backfill_end": time_to,
+        "backfill_watermark": time_from - 1
+    })
+    frappe.db.commit()
+
+    enqueue_backfill(resource_id, stream, window_size, concurrency, account=get_resource_account(resource_id))
+
+def enqueue_backfill(resource_id, stream, window_size=None, concurrency=None, account=None):
+    """Queue run_backfill for a stream unless it is already queued or running."""
+    frappe.enqueue(
+        "wialon_notifications.api.wialon_backfill.run_backfill",
+        queue="long",
+        timeout=BACKFILL_JOB_TIMEOUT,
+        job_id=f"wialon_backfill_{resource_id}_{stream}",
+        deduplicate=True,
+        resource_id=resource_id,
+        stream=stream,
+        window_size=window_size,
+        concurrency=concurrency,
+        account=account
+    )
+
+def resume_backfills():
+    """Scheduled job: restart every backfill that stopped before reaching its end."""
+    cursors = frappe.get_all(
+        CURSOR_DOCTYPE,
+        filters={"backfill_end": [">", 0], "stream": ["in", list(BACKFILL_WINDOWS)]},
+        fields=["resource_id", "stream", "backfill_end", "backfill_watermark"]
+    )
+    for cursor in cursors:
+        if cursor.backfill_watermark < cursor.backfill_end:
+            enqueue_backfill(cursor.resource_id, cursor.stream, account=get_resource_account(cursor.resource_id))
+
+@run_lock("wialon_backfill_{resource_id}_{stream}")
+def run_backfill(resource_id, stream, window_size=None, concurrency=None, account=None):
+    """Background job: fetch and save a stream's backfill range from its checkpoint onwards.
+
+    Wialon is called from worker threads; saving, checkpointing and progress
+    reporting stay on the job thread, which owns the database connection.
+    Stops at the first window that cannot be fetched or saved; the next run
+    resumes from the last checkpoint.
+    """
+    if stream not in BACKFILL_WINDOWS:
+        return
+
+    name = get_cursor_name(resource_id, stream)
+    start, end, watermark = frappe.db.get_value(
+        CURSOR_DOCTYPE, name, ["backfill_start", "backfill_end", "backfill_watermark"]
+    ) or (None, None, None)
+    if not end or watermark >= end:
+        return
+
+    window_size = cint(window_size) or BACKFILL_WINDOWS[stream]
+    concurrency = min(max(cint(concurrency) or BACKFILL_CONCURRENCY, 1), BACKFILL_MAX_CONCURRENCY)
+    client = get_client()
+    guard = get_guard(account, BACKFILL)  # Lowest priority, so interactive calls keep their share
+    session = {"id": get_session_id(account), "account": account, "retries": 0}
+    if not session["id"]:
+        frappe.log_error(f"No Wialon session available for the {stream} backfill", "Wialon Backfill")
+        return
+
+    def fetch(window_start):
+        window_end = min(window_start + window_size - 1, end)
+        params = get_notification_params(resource_id, window_start, window_end)
+        return client.call("events/get", params, sid=session["id"], guard=guard)
+
+    progress = {"started": time.monotonic(), "published": 0, "first": watermark, "rows": 0}
+    windows = iter(range(watermark + 1, end + 1, window_size))
+    finished = set()  # Window starts saved beyond the watermark
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="wialon-backfill")
+    try:
+        in_flight = {executor.submit(fetch, window_start): window_start for window_start in islice(windows, concurrency)}
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                window_start = in_flight.pop(future)
+
+                try:
+                    data = future.result()
+                except WialonAPIError as e:
+                    if e.code != INVALID_SESSION or session["retries"] >= BACKFILL_SESSION_RETRIES:
+                        raise
+                    _renew_session(session)
+                    in_flight[executor.submit(fetch, window_start)] = window_start
+                    continue
+
+                progress["rows"] += _save_window(data)
+
+                # Advance the checkpoint over every window that is now contiguous
+                finished.add(window_start)
+                if watermark + 1 in finished:
+                    while watermark + 1 in finished:
+                        finished.remove(watermark + 1)
+                        watermark = min(watermark + window_size, end)
+                    frappe.db.set_value(CURSOR_DOCTYPE, name, "backfill_watermark", watermark)
+                frappe.db.commit()
+
+                in_flight.update({executor.submit(fetch, next_start): next_start for next_start in islice(windows, 1)})
+                _publish_progress(name, stream, start, end, watermark + len(finished) * window_size, progress)
+
+    except WialonAPIError as e:
+        frappe.log_error(f"{stream} backfill stopped at {watermark}: {str(e)}", "Wialon Backfill")
+        return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    _publish_progress(name, stream, start, end, end, progress, force=True)
+    backfill_log.summary(
+        "finished",
+        resource_id=resource_id,
+        backfill_stream=stream,
+        rows=progress["rows"],
+        seconds=round(time.monotonic() - progress["started"], 1)
+    )
+
+def _ensure_cursor(resource_id, stream):
+    name = get_cursor_name(resource_id, stream)
+    if not frappe.db.exists(CURSOR_DOCTYPE, name):
+        frappe.get_doc({
+            "doctype": CURSOR_DOCTYPE,
+            "resource_id": str(resource_id),
+            "stream": stream
+        }).insert(ignore_permissions=True)
+    return name
+
+def _renew_session(session):
+    invalidate_session(session["id"], session["account"])
+    session["id"] = get_session_id(session["account"])
+    session["retries"] += 1
+    if not session["id"]:
+        raise WialonAPIError("Failed to establish a valid Wialon session", code=INVALID_SESSION)
+
+def _save_window(data):
+    # Returns the number of rows received
+    notifications = data.get("events", [])
+    process_notifications(notifications)
+    flush_unit_updates()
+    return len(notifications)
+
+def _publish_progress(name, stream, start, end, covered, progress, force=False):
+    now = time.monotonic()
+    if not force and now - progress["published"] < PROGRESS_INTERVAL:
+        return
+    progress["published"] = now
+
+    total = end - start + 1
+    covered = min(covered, end) - start + 1
+    rate = (covered - (progress["first"] - start + 1)) / max(now - progress["started"], 1e-6)
+    eta = (total - covered) / rate if rate > 0 else None
+
+    description = f"{progress['rows']} rows saved"
+    if eta is not None and covered < total:
+        description += f", ETA {format_duration(eta)}"
+
+    frappe.publish_progress(
+        covered * 100 / total,
+        title=f"Wialon {stream} Backfill",
+        doctype=CURSOR_DOCTYPE,
+        docname=name,
+        description=description
+    )
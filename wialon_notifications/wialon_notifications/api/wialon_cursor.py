@@ -0,0 +1,64 @@
+import frappe
+import time
+from frappe.utils import now_datetime
+
+# Per-resource, per-stream high-water marks for incremental ingestion. A run
+# fetches (watermark, now - SETTLE_DELAY] and moves the watermark in the same
+# transaction that commits the rows, so windows never overlap or leave gaps.
+CURSOR_DOCTYPE = "Wialon Ingestion Cursor"
+NOTIFICATIONS = "Notifications"
+MESSAGES = "Messages"
+
+INITIAL_LOOKBACK = 15 * 60  # Where a stream without a cursor starts
+SETTLE_DELAY = 30  # The newest seconds are left for the next run while Wialon is still writing them
+MAX_WINDOW = 24 * 3600  # Longer gaps are caught up over several runs
+
+def get_cursor_name(resource_id, stream):
+    """Return the document name of a stream's cursor."""
+    return f"{resource_id}-{stream}"
+
+def get_cursor_window(resource_id, stream):
+    """Return the (time_from, time_to) Unix range the next run of a stream should fetch.
+
+    Both ends are inclusive. time_from > time_to means there is nothing new yet.
+    """
+    time_to = int(time.time()) - SETTLE_DELAY
+    watermark = frappe.db.get_value(CURSOR_DOCTYPE, get_cursor_name(resource_id, stream), "watermark")
+
+    time_from = watermark + 1 if watermark else time_to - INITIAL_LOOKBACK
+    return time_from, min(time_to, time_from + MAX_WINDOW - 1)
+
+def advance_cursor(resource_id, stream, watermark, count=0):
+    """Move a stream's watermark within the current transaction.
+
+    Call this right before committing the rows the window produced, so the
+    rows and the cursor are committed together.
+    """
+    name = get_cursor_name(resource_id, stream)
+    values = {"watermark": watermark, "last_run": now_datetime(), "last_count": count}
+
+    if frappe.db.exists(CURSOR_DOCTYPE, name):
+        frappe.db.set_value(CURSOR_DOCTYPE, name, values)
+    else:
+        frappe.get_doc({
+            "doctype": CURSOR_DOCTYPE,
+            "resource_id": str(resource_id),
+            "stream": stream,
+            **values
+        }).insert(ignore_permissions=True)
+
+@frappe.whitelist()
+def get_ingestion_lag():
+    """Return each cursor's watermark and how many seconds it is behind now."""
+    frappe.only_for("System Manager")
+
+    now = int(time.time())
+    cursors = frappe.get_all(
+        CURSOR_DOCTYPE,
+        fields=["name", "resource_id", "stream", "watermark", "last_run", "last_count"],
+        order_by="name"
+    )
+    for cursor in cursors:
+        cursor["lag_seconds"] = now - cursor.watermark if cursor.watermark else None
+
+    return cursors
@@ -1,43 +1,126 @@
 import frappe
-import requests
 import json
+import time
 from datetime import datetime, timedelta
+from itertools import islice
+from frappe.utils import now_datetime
+from components_core.api.wialon_client import get_client, WialonAPIError
 from components_core.api.wialon_auth import get_valid_session
-
-WIALON_API_URL = "https://hst-api.wialon.com/wialon/ajax.html"
+from components_core.api.wialon_config import get_accounts, get_config, parse_resource_ids
+from components_core.api.wialon_lock import run_lock
+from components_core.api.wialon_log import get_logger
+from wialon_notifications.api.wialon_cursor import MESSAGES, NOTIFICATIONS, advance_cursor, get_cursor_window
 
 FREQUENTLY_USED_EVENT_CODES = [1001, 1002, 1003, 1004, 1005]  # Start, stop, geofence entry/exit, speed violation
-
-def ensure_wialon_unit(unit_id, unit_name="Unknown", unit_type="Vehicle"):
-    """Create or update a Wialon Unit record."""
-    existing = frappe.get_all("Wialon Unit", filters={"unit_id": unit_id})
-    if not existing:
-        doc = frappe.get_doc({
-            "doctype": "Wialon Unit",
-            "unit_id": unit_id,
-            "name": unit_name,
-            "type": unit_type,
-            "last_updated": datetime.now()
-        })
-        doc.insert(ignore_permissions=True)
-        frappe.log("Created Wialon Unit: {}".format(unit_id))
-        print(f"Created Wialon Unit: {unit_id}")
-    else:
-        frappe.db.set_value("Wialon Unit", existing[0].name, "last_updated", datetime.now())
-        frappe.log("Updated Wialon Unit: {}".format(unit_id))
-        print(f"Updated Wialon Unit: {unit_id}")
-
-@frappe.whitelist()
-def fetch_notifications(time_from, time_to, event_codes=None):
-    """Fetch notification events from Wialon for a given time range, optionally filtering by event codes."""
-    config = frappe.get_single("Wialon API Configuration")
-    if not config.resource_id:
-        frappe.throw("Resource ID not configured in Wialon API Configuration")
-
-    session_id = get_valid_session()
-    
+INSERT_CHUNK_SIZE = 500  # Rows per multi-row INSERT
+MESSAGE_CHUNK_SIZE = 2000  # Messages deduplicated and committed together
+NOTIFICATION_CHUNK_SIZE = 2000  # Streamed notifications deduplicated and inserted together
+
+# Scheduled ingestion runs as one job per (resource, stream) on its own queue;
+# see the README for the worker configuration
+INGESTION_QUEUE = "wialon"
+INGESTION_JOB_TIMEOUT = 600
+INGESTION_LOCK = "wialon_ingest_{resource_id}_{stream}"  # One lease lock per shard, see wialon_lock
+
+# Unit IDs known to have a Wialon Unit record: a Redis set shared by all
+# workers, mirrored per process and reloaded every KNOWN_UNITS_LOCAL_TTL
+KNOWN_UNITS_KEY = "wialon_known_units"
+KNOWN_UNITS_TTL = 86400
+KNOWN_UNITS_LOCAL_TTL = 300
+
+_known_units = {}
+_touched_units = {}  # site -> unit IDs waiting for a last_updated write
+
+notifications_log = get_logger("notifications")
+messages_log = get_logger("messages")
+units_log = get_logger("units")
+
+def ensure_wialon_units(unit_ids, unit_type="Vehicle"):
+    """Make sure a Wialon Unit record exists for every unit ID.
+
+    IDs are checked against a process-local set backed by a Redis set, so
+    the database is only asked about units neither has seen before, and all
+    missing units are inserted in one statement. last_updated is not
+    written here; the units are queued for flush_unit_updates instead.
+    """
+    unit_ids = {str(unit_id) for unit_id in unit_ids}
+    if not unit_ids:
+        return
+
+    _touched_units.setdefault(frappe.local.site, set()).update(unit_ids)
+
+    unknown = unit_ids - _get_known_units()
+    if unknown:
+        # Another process may have registered them since our copy was loaded
+        unknown -= _get_known_units(reload=True)
+    if not unknown:
+        return
+
+    # Wialon Unit is named by unit_id
+    stored = set(frappe.get_all("Wialon Unit", filters={"name": ["in", list(unknown)]}, pluck="name"))
+    _remember_units(stored)
+
+    missing = unknown - stored
+    if missing:
+        now = now_datetime()
+        user = frappe.session.user
+        frappe.db.bulk_insert(
+            "Wialon Unit",
+            fields=["name", "creation", "modified", "owner", "modified_by", "docstatus", "unit_id", "type", "last_updated"],
+            values=[(unit_id, now, now, user, user, 0, unit_id, unit_type, now) for unit_id in missing],
+            ignore_duplicates=True
+        )
+        # Only cache new units once they are committed; a rolled back chunk must retry them
+        frappe.db.after_commit.add(lambda: _remember_units(missing))
+
+        units_log.summary("units_created", count=len(missing))
+
+def flush_unit_updates():
+    """Write last_updated once for every unit touched since the last flush.
+
+    Returns:
+        int: Number of units updated.
+    """
+    unit_ids = _touched_units.pop(frappe.local.site, None)
+    if not unit_ids:
+        return 0
+
+    frappe.db.sql(
+        "update `tabWialon Unit` set last_updated = %s where name in %s",
+        (now_datetime(), tuple(unit_ids))
+    )
+    return len(unit_ids)
+
+def forget_wialon_unit(unit_id):
+    """Drop a unit from the known-unit cache, e.g. when its record is deleted."""
+    frappe.cache().srem(KNOWN_UNITS_KEY, str(unit_id))
+    local = _known_units.get(frappe.local.site)
+    if local:
+        local["units"].discard(str(unit_id))
+
+def _get_known_units(reload=False):
+    site = frappe.local.site
+    local = _known_units.get(site)
+    if local and not reload and time.monotonic() < local["expires_at"]:
+        return local["units"]
+
+    units = {unit_id.decode() for unit_id in frappe.cache().smembers(KNOWN_UNITS_KEY)}
+    _known_units[site] = {"units": units, "expires_at": time.monotonic() + KNOWN_UNITS_LOCAL_TTL}
+    return units
+
+def _remember_units(unit_ids):
+    if not unit_ids:
+        return
+
+    cache = frappe.cache()
+    cache.sadd(KNOWN_UNITS_KEY, *unit_ids)
+    cache.expire(cache.make_key(KNOWN_UNITS_KEY), KNOWN_UNITS_TTL)
+    _get_known_units().update(unit_ids)
+
+def get_notification_params(resource_id, time_from, time_to, event_codes=None):
+    """Build events/get parameters for notification events in a time range."""
     params = {
-        "resourceId": int(config.resource_id),
+        "resourceId": int(resource_id),
         "timeFrom": int(time_from),
         "timeTo": int(time_to),
         "type": "avl_evnt"
@@ -45,43 +128,17 @@ def fetch_notifications(time_from, time_to, event_codes=None):
     
     if event_codes:
         params["eventCode"] = event_codes
-    
-    try:
-        response = requests.get(
-            WIALON_API_URL,
-            params={"svc": "events/get", "sid": session_id, "params": json.dumps(params)}
-        )
-        response.raise_for_status()
-        data = response.json()
-        if "error" in data:
-            frappe.log_error(f"Wialon API Error: {data['error']}", "Wialon Notification Fetch")
-            print(f"Wialon API Error in fetch_notifications: {data['error']}")
-            return []
-        frappe.log("Fetched notifications: {}".format(len(data.get("events", []))))
-        print(f"Fetched {len(data.get('events', []))} notifications")
-        return data.get("events", [])
-    except Exception as e:
-        frappe.log_error(f"Failed to fetch notifications: {str(e)}", "Wialon Notification Fetch")
-        print(f"Failed to fetch notifications: {str(e)}")
-        return []
 
-@frappe.whitelist()
-def fetch_messages(time_from, time_to, direction=None):
-    """Fetch message events from Wialon for a given time range, optionally filtering by direction."""
-    config = frappe.get_single("Wialon API Configuration")
-    if not config.resource_id:
-        frappe.throw("Resource ID not configured in Wialon API Configuration")
-
-    session_id = get_valid_session()
-    print(f"Session ID: {session_id}")
-    frappe.log(f"Session ID: {session_id}")
+    return params
 
+def get_message_params(resource_id, time_from, time_to, direction=None):
+    """Build core/search_items parameters for unit messages in a time range."""
     # Use core/search_items to fetch units and their messages
     params = {
         "spec": {
             "itemsType": "avl_unit",
             "propName": "sys_id",
-            "propValueMask": str(config.resource_id),
+            "propValueMask": str(resource_id),
             "sortType": "sys_id"
         },
         "force": 1,
@@ -92,81 +149,120 @@ def fetch_messages(time_from, time_to, direction=None):
     
     if direction:
         params["direction"] = direction
-    
-    print(f"Fetching messages with params: {json.dumps(params, indent=2)}")
-    frappe.log(f"Fetching messages with params: {json.dumps(params)}")
+
+    return params
+
+def parse_messages(data, resource_id):
+    """Extract message events from a core/search_items response."""
+    return list(iter_messages(data, resource_id))
+
+def iter_messages(data, resource_id):
+    """Yield message events from a core/search_items response one at a time."""
+    for unit in data.get("items", []):
+        for msg in unit.get("msgs", {}).get("data", []):
+            yield {
+                "id": msg.get("i", 0),
+                "time": msg.get("t", 0),
+                "resourceId": unit.get("id", resource_id),
+                "details": msg,
+                "direction": "Incoming" if msg.get("f", 0) & 0x0001 else "Outgoing"
+            }
+
+def stream_notifications(resource_id, time_from, time_to, event_codes=None, account=None):
+    """Yield notification events for a time range while the Wialon response is still being read."""
+    params = get_notification_params(resource_id, time_from, time_to, event_codes)
+    return get_client().stream_items_with_session("events/get", params, prefix="events.item", account=account)
+
+@frappe.whitelist()
+def fetch_notifications(time_from, time_to, event_codes=None):
+    """Fetch notification events from Wialon for a given time range, optionally filtering by event codes."""
+    params = get_notification_params(get_resource_id(), time_from, time_to, event_codes)
     
     try:
-        response = requests.get(
-            WIALON_API_URL,
-            params={"svc": "core/search_items", "sid": session_id, "params": json.dumps(params)}
-        )
-        response.raise_for_status()
-        data = response.json()
-        print(f"Raw API response: {json.dumps(data, indent=2)}")
-        frappe.log(f"Raw API response: {json.dumps(data)}")
-        
-        if "error" in data:
-            frappe.log_error(f"Wialon API Error: {data['error']}", "Wialon Message Fetch")
-            print(f"Wialon API Error in fetch_messages: {data['error']}")
-            return []
-        
-        # Extract messages from units
-        messages = []
-        units = data.get("items", [])
-        for unit in units:
-            unit_messages = unit.get("msgs", {}).get("data", [])
-            for msg in unit_messages:
-                messages.append({
-                    "id": msg.get("i", 0),
-                    "time": msg.get("t", 0),
-                    "resourceId": unit.get("id", config.resource_id),
-                    "details": msg,
-                    "direction": "Incoming" if msg.get("f", 0) & 0x0001 else "Outgoing"
-                })
-        
-        print(f"Fetched {len(messages)} messages")
-        frappe.log(f"Fetched {len(messages)} messages")
-        if messages:
-            print("Sample message:", json.dumps(messages[0], indent=2))
+        data = get_client().call_with_session("events/get", params)
+        notifications_log.summary("fetched", count=len(data.get("events", [])), time_from=time_from, time_to=time_to)
+        notifications_log.debug("fetch_response", params=params, response=data)
+        return data.get("events", [])
+    except WialonAPIError as e:
+        frappe.log_error(f"Failed to fetch notifications: {str(e)}", "Wialon Notification Fetch")
+        return []
+
+@frappe.whitelist()
+def fetch_messages(time_from, time_to, direction=None):
+    """Fetch message events from Wialon for a given time range, optionally filtering by direction."""
+    resource_id = get_resource_id()
+
+    params = get_message_params(resource_id, time_from, time_to, direction)
+
+    try:
+        messages = parse_messages(get_client().call_with_session("core/search_items", params), resource_id)
+        messages_log.summary("fetched", count=len(messages), time_from=time_from, time_to=time_to)
         return messages
-    except Exception as e:
+    except WialonAPIError as e:
         frappe.log_error(f"Failed to fetch messages: {str(e)}", "Wialon Message Fetch")
-        print(f"Failed to fetch messages: {str(e)}")
         return []
 
 def process_notifications(notifications):
-    """Process and save notification events to the Wialon Notification DocType."""
-    print(f"Processing {len(notifications)} notifications")
-    frappe.log(f"Processing {len(notifications)} notifications")
+    """Save notification events to the Wialon Notification DocType, skipping stored ones.
+
+    Existing events in the batch's time window are read in one query and new
+    ones are written with chunked multi-row inserts. The unique event key
+    makes the insert safe against a concurrent run saving the same events.
+
+    Returns:
+        int: Number of notifications inserted.
+    """
+
+    # Key on the unique (template_id, unit_id, event_time) index; the last
+    # copy of an event repeated within the batch wins
+    rows = {}
     for event in notifications:
-        event_time = datetime.fromtimestamp(event["time"])
-        unit_id = str(event["resourceId"])
-        event_type = get_event_type(event["eventCode"])
-        message = json.dumps(event["details"])
-        
-        ensure_wialon_unit(unit_id)
-        
-        existing = frappe.get_all("Wialon Notification", filters={
-            "template_id": event["id"],
-            "unit_id": unit_id,
-            "event_time": event_time
-        })
-        if not existing:
-            doc = frappe.get_doc({
-                "doctype": "Wialon Notification",
-                "template_id": event["id"],
-                "unit_id": unit_id,
-                "event_time": event_time,
-                "type": event_type,
-                "message": message
-            })
-            doc.insert(ignore_permissions=True)
-            print(f"Saved notification: {event['id']}")
-            frappe.log(f"Saved notification: {event['id']}")
-        else:
-            print(f"Notification {event['id']} already exists, skipping")
-            frappe.log(f"Notification {event['id']} already exists, skipping")
+        key = (str(event["id"]), str(event["resourceId"]), datetime.fromtimestamp(event["time"]))
+        rows[key] = (get_event_type(event["eventCode"]), json.dumps(event["details"]))
+
+    if not rows:
+        return 0
+
+    ensure_wialon_units(unit_id for _, unit_id, _ in rows)
+
+    event_times = [event_time for _, _, event_time in rows]
+    existing = get_existing_notification_keys(min(event_times), max(event_times))
+    new_keys = [key for key in rows if key not in existing]
+
+    now = now_datetime()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        "Wialon Notification",
+        fields=[
+            "name", "creation", "modified", "owner", "modified_by", "docstatus",
+            "template_id", "unit_id", "event_time", "type", "message"
+        ],
+        values=[
+            (frappe.generate_hash(length=10), now, now, user, user, 0, *key, *rows[key])
+            for key in new_keys
+        ],
+        ignore_duplicates=True,
+        chunk_size=INSERT_CHUNK_SIZE
+    )
+
+    notifications_log.summary(
+        "batch_saved",
+        received=len(notifications),
+        inserted=len(new_keys),
+        skipped=len(notifications) - len(new_keys)
+    )
+    return len(new_keys)
+
+def get_existing_notification_keys(time_from, time_to):
+    """Return the (template_id, unit_id, event_time) keys already stored in a time window."""
+    return set(frappe.db.sql(
+        """
+        select template_id, unit_id, event_time
+        from `tabWialon Notification`
+        where event_time between %s and %s
+        """,
+        (time_from, time_to)
+    ))
 
 def get_event_type(event_code):
     """Map event code to human-readable type."""
@@ -192,86 +288,232 @@ def trigger_workflow(notification_type, unit_id):
 
 def process_messages(messages):
     """Process and save message events to the Wialon Message DocType."""
-    print(f"Processing {len(messages)} messages")
-    frappe.log(f"Processing {len(messages)} messages")
-    for msg in messages:
+    return write_messages(messages)
+
+def write_messages(messages, chunk_size=MESSAGE_CHUNK_SIZE):
+    """Bulk-write an iterable of parsed messages to Wialon Message.
+
+    Messages are consumed chunk_size at a time, so the input may be a
+    generator of any length. Each chunk is deduplicated in memory, checked
+    against the rows already stored for its units and time window in one
+    query, inserted with multi-row INSERTs and committed on its own. The
+    unique message key catches duplicates split across chunks or written by
+    a concurrent run. A failed chunk is rolled back and logged; later chunks
+    are still written.
+
+    Returns:
+        dict: received/inserted/skipped/failed counts, elapsed seconds and rows_per_sec.
+    """
+    stats = {"received": 0, "inserted": 0, "skipped": 0, "failed": 0}
+    started = time.monotonic()
+
+    messages = iter(messages)
+    while True:
+        chunk = list(islice(messages, chunk_size))
+        if not chunk:
+            break
+        stats["received"] += len(chunk)
+
         try:
-            message_time = datetime.fromtimestamp(msg["time"])
-            unit_id = str(msg["resourceId"])
-            direction = msg.get("direction", "Unknown")
-            content = json.dumps(msg["details"])
-            
-            ensure_wialon_unit(unit_id)
-            
-            existing = frappe.get_all("Wialon Message", filters={
-                "message_id": msg["id"],
-                "unit_id": unit_id,
-                "message_time": message_time
-            })
-            if not existing:
-                doc = frappe.get_doc({
-                    "doctype": "Wialon Message",
-                    "message_id": msg["id"],
-                    "unit_id": unit_id,
-                    "message_time": message_time,
-                    "direction": direction,
-                    "content": content
-                })
-                doc.insert(ignore_permissions=True)
-                print(f"Saved message: {msg['id']}")
-                frappe.log(f"Saved message: {msg['id']}")
-            else:
-                print(f"Message {msg['id']} already exists, skipping")
-                frappe.log(f"Message {msg['id']} already exists, skipping")
+            inserted = _write_message_chunk(chunk)
+            frappe.db.commit()
         except Exception as e:
-            print(f"Failed to process message {msg.get('id', 'unknown')}: {str(e)}")
-            frappe.log_error(f"Failed to process message {msg.get('id', 'unknown')}: {str(e)}", "Wialon Message Process")
+            frappe.db.rollback()
+            stats["failed"] += len(chunk)
+            frappe.log_error(f"Failed to save {len(chunk)} messages: {str(e)}", "Wialon Message Process")
+            continue
+
+        stats["inserted"] += inserted
+        stats["skipped"] += len(chunk) - inserted
+        messages_log.sampled("chunk_saved", every=50, received=len(chunk), inserted=inserted)
+        messages_log.debug("chunk_sample", message=chunk[0])
+
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    stats["rows_per_sec"] = round(stats["received"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+
+    messages_log.summary("batch_saved", **stats)
+    return stats
+
+def _write_message_chunk(chunk):
+    # Key on the unique (message_id, unit_id, message_time) index
+    rows = {}
+    for msg in chunk:
+        key = (str(msg["id"]), str(msg["resourceId"]), datetime.fromtimestamp(msg["time"]))
+        rows[key] = msg
+
+    unit_ids = {unit_id for _, unit_id, _ in rows}
+    ensure_wialon_units(unit_ids)
+
+    message_times = [message_time for _, _, message_time in rows]
+    existing = set(frappe.db.sql(
+        """
+        select message_id, unit_id, message_time
+        from `tabWialon Message`
+        where unit_id in %(unit_ids)s and message_time between %(time_from)s and %(time_to)s
+        """,
+        {"unit_ids": tuple(unit_ids), "time_from": min(message_times), "time_to": max(message_times)}
+    ))
+    new_keys = [key for key in rows if key not in existing]
+
+    now = now_datetime()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        "Wialon Message",
+        fields=[
+            "name", "creation", "modified", "owner", "modified_by", "docstatus",
+            "message_id", "unit_id", "message_time", "direction", "content"
+        ],
+        values=[
+            (
+                frappe.generate_hash(length=10), now, now, user, user, 0, *key,
+                rows[key].get("direction"), json.dumps(rows[key]["details"], separators=(",", ":"))
+            )
+            for key in new_keys
+        ],
+        ignore_duplicates=True,
+        chunk_size=INSERT_CHUNK_SIZE
+    )
+
+    return len(new_keys)
+
+def get_resource_id():
+    """Return the default account's Wialon resource ID."""
+    resource_ids = parse_resource_ids(get_config().resource_id)
+    if not resource_ids:
+        frappe.throw("Resource ID not configured in Wialon API Configuration")
+    return resource_ids[0]
+
+def get_ingestion_targets():
+    """Return an (account, resource_id) pair for every resource of every enabled account.
+
+    Resources are taken from each account's broker session, so accounts
+    without configured resource IDs contribute every resource they can see.
+    An account that cannot authenticate is logged and left out.
+    """
+    targets = []
+    for account in get_accounts():
+        session = get_valid_session(account)
+        if not session.get("session_id"):
+            frappe.log_error(f"Skipping Wialon account {account}: {session.get('error')}", "Wialon Ingestion")
+            continue
+        targets.extend((account, str(resource_id)) for resource_id in session["resource_ids"])
+    return targets
+
+def get_resource_account(resource_id):
+    """Return the account that ingests a resource, or None if no enabled account does."""
+    for account, target_resource_id in get_ingestion_targets():
+        if target_resource_id == str(resource_id):
+            return account
+    return None
+
+def save_notification_window(resource_id, notifications, time_to):
+    """Save a window of notifications and advance the cursor in the same commit.
+
+    Notifications are consumed NOTIFICATION_CHUNK_SIZE at a time, so the
+    input may be a generator such as stream_notifications. The chunks and
+    the cursor are committed together once the input is exhausted.
+    """
+    received = 0
+    notifications = iter(notifications)
+    while True:
+        chunk = list(islice(notifications, NOTIFICATION_CHUNK_SIZE))
+        if not chunk:
+            break
+        received += len(chunk)
+        process_notifications(chunk)
+
+    flush_unit_updates()
+    advance_cursor(resource_id, NOTIFICATIONS, time_to, received)
+    frappe.db.commit()
+
+def enqueue_ingestion():
+    """Scheduled job: queue one ingestion job per resource and stream of every account on the wialon queue.
+
+    Shards run in parallel on however many wialon workers are available, each
+    with its account's own session and its resource's own cursor, so the
+    worker count bounds the concurrency. A shard that is still queued or
+    running is not queued again, so a slow Wialon call only delays its own
+    resource and stream.
+    """
+    for account, resource_id in get_ingestion_targets():
+        for stream in INGESTION_STREAMS:
+            frappe.enqueue(
+                "wialon_notifications.api.wialon_notifications.ingest_shard",
+                queue=INGESTION_QUEUE,
+                timeout=INGESTION_JOB_TIMEOUT,
+                job_id=f"wialon_ingest_{resource_id}_{stream}",
+                deduplicate=True,
+                resource_id=resource_id,
+                stream=stream,
+                account=account
+            )
+
+def ingest_shard(resource_id, stream, account=None):
+    """Background job: ingest one stream of one resource from its cursor."""
+    ingest = INGESTION_STREAMS.get(stream)
+    if ingest is None:
+        # Queued before the stream was taken out of INGESTION_STREAMS
+        return
+
+    ingest(resource_id, account=account)
+
+@run_lock(INGESTION_LOCK.replace("{stream}", NOTIFICATIONS))
+def ingest_notifications(resource_id, account=None):
+    """Fetch and save a resource's notifications since its cursor, focusing on frequently used types."""
+    time_from, time_to = get_cursor_window(resource_id, NOTIFICATIONS)
+    if time_from > time_to:
+        return
+
+    # Notifications are written while the response is still streaming in; an
+    # error part-way rolls the window back and leaves the cursor in place
+    try:
+        save_notification_window(resource_id, stream_notifications(
+            resource_id, time_from, time_to, event_codes=FREQUENTLY_USED_EVENT_CODES, account=account
+        ), time_to)
+    except WialonAPIError as e:
+        frappe.db.rollback()
+        frappe.log_error(f"Failed to fetch notifications: {str(e)}", "Wialon Notification Fetch")
 
 @frappe.whitelist()
 def fetch_and_save_notifications():
-    """Fetch and save notifications for the last 15 minutes, focusing on frequently used types."""
-    now = datetime.now()
-    time_to = int(now.timestamp())
-    time_from = int((now - timedelta(minutes=15)).timestamp())
-    
-    notifications = fetch_notifications(time_from, time_to, event_codes=FREQUENTLY_USED_EVENT_CODES)
-    process_notifications(notifications)
+    """Fetch and save notifications of every account's resources since the last run, focusing on frequently used types.
+
+    Runs in the request and takes the same per-shard locks as the queued
+    ingestion jobs: shards it is working on are skipped by a scheduled run,
+    and resources a queued job is working on are skipped here.
+    """
+    frappe.only_for("System Manager")
+
+    for account, resource_id in get_ingestion_targets():
+        ingest_notifications(resource_id, account=account)
 
 @frappe.whitelist()
 def fetch_all_past_notifications():
-    """Fetch and save all past notifications from the beginning to now, all types."""
-    now = datetime.now()
-    time_to = int(now.timestamp())
-    time_from = 0  # Unix epoch
-    
-    notifications = fetch_notifications(time_from, time_to)
-    process_notifications(notifications)
+    """Start a background backfill of past notifications, all types."""
+    from wialon_notifications.api.wialon_backfill import start_backfill
+
+    start_backfill(NOTIFICATIONS)
 
 @frappe.whitelist()
 def fetch_and_save_messages():
-    """Fetch and save messages for the last 15 minutes."""
-    now = datetime.now()
-    time_to = int(now.timestamp())
-    time_from = int((now - timedelta(minutes=15)).timestamp())
-    
-    messages = fetch_messages(time_from, time_to)
-    process_messages(messages)
+    """Refuse to ingest messages; see INGESTION_STREAMS."""
+    frappe.only_for("System Manager")
+    frappe.throw("Messages are not ingested: Wialon does not return messages by time range through core/search_items")
+
+# Streams the scheduler ingests. Messages are left out: get_message_params
+# sends Unix times as the core/search_items from/to, which Wialon reads as
+# item indexes, so every window came back empty while the Messages cursor
+# still moved on and marked it done.
+INGESTION_STREAMS = {
+    NOTIFICATIONS: ingest_notifications
+}
 
 @frappe.whitelist()
 def fetch_all_past_messages():
-    """Fetch and save all past messages from the beginning to now."""
-    now = datetime.now()
-    time_to = int(now.timestamp())
-    time_from = 0  # Unix epoch
-    
-    messages = fetch_messages(time_from, time_to)
-    process_messages(messages)
-
-
-
-
-
+    """Refuse to backfill past messages; see BACKFILL_WINDOWS in wialon_backfill."""
+    from wialon_notifications.api.wialon_backfill import start_backfill
 
+    start_backfill(MESSAGES)
 
 
 # import frappe
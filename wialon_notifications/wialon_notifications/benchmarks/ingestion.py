@@ -0,0 +1,355 @@
+import frappe
+import json
+import math
+import os
+import platform
+import time
+from components_core.api.wialon_client import WialonClient
+from components_core.simulator import EVENT_INTERVAL, FIRST_RESOURCE_ID, start_simulator
+from wialon_notifications.api.wialon_cursor import MESSAGES, NOTIFICATIONS
+from wialon_notifications.api.wialon_notifications import (
+    flush_unit_updates,
+    forget_wialon_unit,
+    get_notification_params,
+    iter_messages,
+    process_messages,
+    process_notifications
+)
+
+# Ingestion benchmark: synthetic event streams go through the same
+# fetch -> dedup -> insert path as scheduled ingestion, one batch at a time,
+# and the run is compared against a JSON baseline recorded on the same
+# machine. Run it on a test site; it writes real rows for a reserved range of
+# unit IDs and deletes them again afterwards.
+#
+#   WIALON_BENCHMARK=1 bench --site test_site run-tests --app wialon_notifications
+#   bench --site test_site execute wialon_notifications.benchmarks.ingestion.run --kwargs "{'stream': 'Messages', 'rows': 100000}"
+#
+# Environment (used by the test cases):
+#   WIALON_BENCHMARK            set to run the benchmark tests at all
+#   WIALON_BENCHMARK_ROWS       rows per run (default 20000)
+#   WIALON_BENCHMARK_BATCH      rows per fetched batch (default 2000)
+#   WIALON_BENCHMARK_SOURCE     "synthetic" (in-process payloads) or "simulator" (HTTP,
+#                               notifications only: like Wialon, it returns no messages
+#                               for the time-range search the message ingestion sends)
+#   WIALON_BENCHMARK_THRESHOLD  allowed regression, as a fraction (default 0.2)
+#   WIALON_BENCHMARK_BASELINES  baselines file (default: wialon_benchmark_baselines.json in the site)
+#   WIALON_BENCHMARK_UPDATE     set to record this run as the baseline; without it
+#                               a missing baseline fails the run
+BENCHMARK_ENV = "WIALON_BENCHMARK"
+BASELINES_ENV = "WIALON_BENCHMARK_BASELINES"
+BASELINES_FILE = "wialon_benchmark_baselines.json"
+
+DEFAULT_ROWS = 20000
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_DUPLICATE_RATIO = 0.1  # Share of each batch re-sent from the previous one, for the dedup path
+DEFAULT_THRESHOLD = 0.2
+SYNTHETIC = "synthetic"
+SIMULATOR = "simulator"
+
+# Unit IDs [BENCH_UNIT_ID_BASE, BENCH_UNIT_ID_BASE + BENCH_UNIT_ID_COUNT) are
+# reserved for the benchmark, far from real Wialon IDs; it never deletes others
+BENCH_UNIT_ID_BASE = 990000000
+BENCH_UNIT_ID_COUNT = 1000000
+BENCH_UNITS = 1000  # Units the synthetic source spreads rows over
+BENCH_DAYS_BACK = 30
+
+# Metric -> True if higher is better
+METRICS = {
+    "rows_per_sec": True,
+    "queries_per_row": False,
+    "p50_ms": False,
+    "p99_ms": False,
+    "peak_rss_mb": False
+}
+
+def run(stream=NOTIFICATIONS, rows=DEFAULT_ROWS, batch_size=DEFAULT_BATCH_SIZE, source=SYNTHETIC,
+        duplicate_ratio=DEFAULT_DUPLICATE_RATIO, threshold=DEFAULT_THRESHOLD, update_baseline=False,
+        baselines_path=None):
+    """Benchmark one stream, compare it with its baseline and return the result.
+
+    Throws if a metric regressed by more than ``threshold`` or the
+    configuration has no baseline yet. With ``update_baseline`` the run is
+    recorded as the baseline instead.
+    """
+    result = run_benchmark(stream, rows, batch_size, source, duplicate_ratio)
+    result["regressions"] = check_baseline(result, baselines_path, threshold, update_baseline)
+    if result["regressions"]:
+        frappe.throw("Ingestion benchmark regressed:<br>" + "<br>".join(result["regressions"]))
+    return result
+
+def run_from_env(stream):
+    """Run the benchmark for a stream configured from WIALON_BENCHMARK_* variables."""
+    result = run_benchmark(
+        stream,
+        rows=int(os.environ.get("WIALON_BENCHMARK_ROWS") or DEFAULT_ROWS),
+        batch_size=int(os.environ.get("WIALON_BENCHMARK_BATCH") or DEFAULT_BATCH_SIZE),
+        source=os.environ.get("WIALON_BENCHMARK_SOURCE") or SYNTHETIC
+    )
+    result["regressions"] = check_baseline(
+        result,
+        baselines_path=os.environ.get(BASELINES_ENV),
+        threshold=float(os.environ.get("WIALON_BENCHMARK_THRESHOLD") or DEFAULT_THRESHOLD),
+        update_baseline=bool(os.environ.get("WIALON_BENCHMARK_UPDATE"))
+    )
+    return result
+
+def run_benchmark(stream, rows=DEFAULT_ROWS, batch_size=DEFAULT_BATCH_SIZE, source=SYNTHETIC,
+        duplicate_ratio=DEFAULT_DUPLICATE_RATIO):
+    """Feed ``rows`` events of a stream through fetch -> dedup -> insert and measure it.
+
+    Returns:
+        dict: The configuration, received/duplicates/inserted counts,
+        rows_per_sec, queries_per_row, p50_ms, p99_ms (per-batch latency,
+        fetch included) and peak_rss_mb.
+    """
+    if stream not in (NOTIFICATIONS, MESSAGES):
+        frappe.throw(f"Unknown stream {stream}")
+    if source not in (SYNTHETIC, SIMULATOR):
+        frappe.throw(f"Unknown benchmark source {source}")
+    if source == SIMULATOR and stream == MESSAGES:
+        frappe.throw("The simulator serves no messages to the message ingestion; benchmark Messages with the synthetic source")
+    if source == SIMULATOR and batch_size > BENCH_UNIT_ID_COUNT:
+        frappe.throw(f"The simulator source needs one unit per row of a batch; use at most {BENCH_UNIT_ID_COUNT}")
+
+    unit_ids = _get_unit_ids(source, batch_size)
+    _cleanup(stream, unit_ids)
+    fetch, stop = _get_fetcher(stream, source, batch_size)
+
+    counter = _QueryCounter()
+    latencies = []
+    totals = {"received": 0, "duplicates": 0, "inserted": 0}
+    previous = []
+    try:
+        with counter:
+            started = time.monotonic()
+            for batch_index in range(math.ceil(rows / batch_size)):
+                batch_started = time.monotonic()
+
+                events = fetch(batch_index)
+                # Re-send part of the previous batch, as overlapping windows would
+                duplicates = previous[:int(len(events) * duplicate_ratio)]
+                previous = events
+                events = events + duplicates
+
+                totals["received"] += len(events)
+                totals["duplicates"] += len(duplicates)
+                totals["inserted"] += _save(stream, events)
+                latencies.append(time.monotonic() - batch_started)
+            seconds = time.monotonic() - started
+    finally:
+        stop()
+        _cleanup(stream, unit_ids)
+
+    return {
+        "stream": stream,
+        "source": source,
+        "rows": rows,
+        "batch_size": batch_size,
+        "duplicate_ratio": duplicate_ratio,
+        "received": totals["received"],
+        "duplicates": totals["duplicates"],
+        "inserted": totals["inserted"],
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(totals["received"] / seconds, 1) if seconds else 0.0,
+        "queries_per_row": round(counter.count / totals["received"], 4) if totals["received"] else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "peak_rss_mb": _peak_rss_mb()
+    }
+
+def check_baseline(result, baselines_path=None, threshold=DEFAULT_THRESHOLD, update_baseline=False):
+    """Compare a result with its stored baseline and return the problems found.
+
+    A configuration without a baseline is reported as a problem too. With
+    ``update_baseline`` the result is recorded as the baseline and passes.
+    """
+    baselines_path = get_baselines_path(baselines_path)
+    baselines = load_baselines(baselines_path)
+    key = get_baseline_key(result)
+    baseline = baselines.get(key)
+
+    if update_baseline:
+        baselines[key] = dict(
+            {metric: result[metric] for metric in METRICS},
+            python=platform.python_version(),
+            machine=platform.machine(),
+            cpus=os.cpu_count()
+        )
+        save_baselines(baselines_path, baselines)
+        return []
+
+    if baseline is None:
+        return [f"{key}: no baseline in {baselines_path}; record one with update_baseline (WIALON_BENCHMARK_UPDATE=1)"]
+
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        expected, actual = baseline.get(metric), result[metric]
+        if not expected or actual is None:
+            continue
+        change = (actual - expected) / expected
+        if (-change if higher_is_better else change) > threshold:
+            regressions.append(f"{key} {metric}: {actual} vs baseline {expected} ({change:+.1%})")
+
+    return regressions
+
+def get_baseline_key(result):
+    return f"{result['stream']}|{result['source']}|{result['rows']}|{result['batch_size']}|{result['duplicate_ratio']}"
+
+def get_baselines_path(path=None):
+    """Return the baselines file: ``path``, WIALON_BENCHMARK_BASELINES or one in the site directory."""
+    return path or os.environ.get(BASELINES_ENV) or frappe.get_site_path(BASELINES_FILE)
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_baselines(path, baselines):
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+def _get_fetcher(stream, source, batch_size):
+    # Returns (fetch(batch_index) -> parsed events, stop())
+    if source == SYNTHETIC:
+        return _get_synthetic_fetcher(stream, batch_size), lambda: None
+
+    # One simulated unit per row: each window holds exactly one event per unit
+    server, url = start_simulator(units=batch_size, first_unit_id=BENCH_UNIT_ID_BASE)
+    client = WialonClient(url)
+    sid = client.call("token/login", {"token": "benchmark"}, guard=_UNLIMITED)["eid"]
+    time_base = int(time.time()) - BENCH_DAYS_BACK * 86400
+
+    def fetch(batch_index):
+        time_from = time_base + batch_index * EVENT_INTERVAL
+        params = get_notification_params(FIRST_RESOURCE_ID, time_from, time_from + EVENT_INTERVAL - 1)
+        # Parsed incrementally, as stream_notifications does for the ingestion
+        return list(client.stream_items("events/get", params, prefix="events.item", sid=sid, guard=_UNLIMITED))
+
+    return fetch, server.shutdown
+
+def _get_synthetic_fetcher(stream, batch_size):
+    time_base = int(time.time()) - BENCH_DAYS_BACK * 86400
+
+    def fetch(batch_index):
+        # Build the response body Wialon would send and decode it, so the
+        # fetch stage includes JSON parsing like a real call
+        first = batch_index * batch_size
+        indexes = range(first, first + batch_size)
+        if stream == NOTIFICATIONS:
+            body = json.dumps({"events": [_synthetic_event(n, time_base) for n in indexes]})
+            return json.loads(body)["events"]
+
+        units = {}
+        for n in indexes:
+            units.setdefault(BENCH_UNIT_ID_BASE + n % BENCH_UNITS, []).append(_synthetic_message(n, time_base))
+        body = json.dumps({"items": [{"id": unit_id, "msgs": {"data": msgs}} for unit_id, msgs in units.items()]})
+        return list(iter_messages(json.loads(body), None))
+
+    return fetch
+
+def _synthetic_event(n, time_base):
+    unit_id = BENCH_UNIT_ID_BASE + n % BENCH_UNITS
+    return {
+        "id": n % 5 + 1,
+        "resourceId": unit_id,
+        "time": time_base + n,
+        "eventCode": 1001 + n % 5,
+        "details": {"unit": f"BENCH-{unit_id}", "pos": _synthetic_position(n, time_base)}
+    }
+
+def _synthetic_message(n, time_base):
+    return {"i": n, "t": time_base + n, "f": n % 2, "tp": "ud", "pos": _synthetic_position(n, time_base), "p": {"io": n % 8}}
+
+def _synthetic_position(n, time_base):
+    return {"t": time_base + n, "y": 10 + (n % 1000) / 1000, "x": 20 + (n % 997) / 997, "z": 0, "s": n % 120, "c": n % 360, "sc": 8}
+
+def _save(stream, events):
+    # The same writers and unit bookkeeping scheduled ingestion uses
+    if stream == NOTIFICATIONS:
+        inserted = process_notifications(events)
+    else:
+        inserted = process_messages(events)["inserted"]
+    flush_unit_updates()
+    frappe.db.commit()
+    return inserted
+
+def _get_unit_ids(source, batch_size):
+    # The simulator numbers its units from BENCH_UNIT_ID_BASE, one per row of a batch
+    count = BENCH_UNITS if source == SYNTHETIC else batch_size
+    return [str(BENCH_UNIT_ID_BASE + n) for n in range(count)]
+
+def _cleanup(stream, unit_ids):
+    # Also run before the benchmark, to remove leftovers of an aborted run
+    outside = [unit_id for unit_id in unit_ids if not _is_bench_unit(unit_id)]
+    if outside:
+        frappe.throw(f"Refusing to delete rows of units outside the benchmark range, e.g. {outside[0]}")
+
+    doctype = "Wialon Notification" if stream == NOTIFICATIONS else "Wialon Message"
+    unit_ids = sorted(unit_ids)
+    for start in range(0, len(unit_ids), 1000):
+        chunk = tuple(unit_ids[start:start + 1000])
+        frappe.db.sql(f"delete from `tab{doctype}` where unit_id in %s", (chunk,))
+        frappe.db.sql("delete from `tabWialon Unit` where name in %s", (chunk,))
+    frappe.db.commit()
+
+    for unit_id in unit_ids:
+        forget_wialon_unit(unit_id)
+
+def _is_bench_unit(unit_id):
+    return str(unit_id).isdigit() and BENCH_UNIT_ID_BASE <= int(unit_id) < BENCH_UNIT_ID_BASE + BENCH_UNIT_ID_COUNT
+
+def _percentile(values, fraction):
+    # Nearest-rank percentile
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+class _QueryCounter:
+    """Count frappe.db.sql calls, including those made by bulk_insert, while active."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        db = frappe.db
+        sql = db.sql
+
+        def counted_sql(*args, **kwargs):
+            self.count += 1
+            return sql(*args, **kwargs)
+
+        db.sql = counted_sql
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        del frappe.db.sql  # Back to the class method
+
+
+class _Unlimited:
+    """Admits every call: the simulator has no quota to protect."""
+
+    def admit(self, svc):
+        return False
+
+    def record_success(self, probe):
+        pass
+
+    def record_failure(self, probe, svc):
+        pass
+
+
+_UNLIMITED = _Unlimited()
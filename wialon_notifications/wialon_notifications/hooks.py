@@ -12,10 +12,12 @@ website_route_rules = [
 ]
 
 scheduler_events = {
+    "hourly": [
+        "wialon_notifications.api.wialon_backfill.resume_backfills"
+    ],
     "cron": {
         "*/15 * * * *": [
-            "wialon_notifications.api.wialon_notifications.fetch_and_save_notifications",
-            "wialon_notifications.api.wialon_notifications.fetch_and_save_messages"
+            "wialon_notifications.api.wialon_notifications.enqueue_ingestion"
         ]
     }
 }
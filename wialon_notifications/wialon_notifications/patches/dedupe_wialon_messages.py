@@ -0,0 +1,22 @@
+import frappe
+
+
+def execute():
+	"""Remove duplicate Wialon Message rows before the message key becomes unique.
+
+	Keeps the first stored row for each (message_id, unit_id, message_time).
+	"""
+	if not frappe.db.table_exists("Wialon Message"):
+		return
+
+	frappe.db.sql(
+		"""
+		delete later from `tabWialon Message` later
+		join `tabWialon Message` earlier
+			on earlier.message_id = later.message_id
+			and earlier.unit_id = later.unit_id
+			and earlier.message_time = later.message_time
+			and (earlier.creation < later.creation
+				or (earlier.creation = later.creation and earlier.name < later.name))
+		"""
+	)
@@ -0,0 +1,22 @@
+import frappe
+
+
+def execute():
+	"""Remove duplicate Wialon Notification rows before the event key becomes unique.
+
+	Keeps the first stored row for each (template_id, unit_id, event_time).
+	"""
+	if not frappe.db.table_exists("Wialon Notification"):
+		return
+
+	frappe.db.sql(
+		"""
+		delete later from `tabWialon Notification` later
+		join `tabWialon Notification` earlier
+			on earlier.template_id = later.template_id
+			and earlier.unit_id = later.unit_id
+			and earlier.event_time = later.event_time
+			and (earlier.creation < later.creation
+				or (earlier.creation = later.creation and earlier.name < later.name))
+		"""
+	)
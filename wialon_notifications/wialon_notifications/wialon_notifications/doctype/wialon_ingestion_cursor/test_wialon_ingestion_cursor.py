@@ -0,0 +1,72 @@
+# Copyright (c) 2026, Ben and Contributors
+# See license.txt
+
+import frappe
+from unittest.mock import patch
+from frappe.tests.utils import FrappeTestCase
+from wialon_notifications.api.wialon_cursor import (
+	CURSOR_DOCTYPE,
+	INITIAL_LOOKBACK,
+	MAX_WINDOW,
+	MESSAGES,
+	NOTIFICATIONS,
+	SETTLE_DELAY,
+	advance_cursor,
+	get_cursor_name,
+	get_cursor_window
+)
+
+NOW = 1767225600  # 2026-01-01 00:00:00 UTC
+RESOURCE_ID = "test-cursor-resource"
+
+
+class TestWialonIngestionCursor(FrappeTestCase):
+	def setUp(self):
+		frappe.db.delete(CURSOR_DOCTYPE, {"resource_id": RESOURCE_ID})
+		clock = patch("wialon_notifications.api.wialon_cursor.time.time", return_value=NOW)
+		clock.start()
+		self.addCleanup(clock.stop)
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_window_without_cursor(self):
+		self.assertEqual(
+			get_cursor_window(RESOURCE_ID, NOTIFICATIONS),
+			(NOW - SETTLE_DELAY - INITIAL_LOOKBACK, NOW - SETTLE_DELAY)
+		)
+
+	def test_window_starts_after_watermark(self):
+		advance_cursor(RESOURCE_ID, NOTIFICATIONS, NOW - 600, count=5)
+
+		self.assertEqual(get_cursor_window(RESOURCE_ID, NOTIFICATIONS), (NOW - 599, NOW - SETTLE_DELAY))
+		self.assertEqual(frappe.db.get_value(CURSOR_DOCTYPE, get_cursor_name(RESOURCE_ID, NOTIFICATIONS), "last_count"), 5)
+
+	def test_settle_delay_leaves_newest_seconds(self):
+		advance_cursor(RESOURCE_ID, NOTIFICATIONS, NOW - SETTLE_DELAY)
+
+		time_from, time_to = get_cursor_window(RESOURCE_ID, NOTIFICATIONS)
+		self.assertGreater(time_from, time_to)
+
+	def test_long_gap_is_caught_up_in_windows(self):
+		watermark = NOW - 3 * MAX_WINDOW
+		advance_cursor(RESOURCE_ID, MESSAGES, watermark)
+
+		self.assertEqual(get_cursor_window(RESOURCE_ID, MESSAGES), (watermark + 1, watermark + MAX_WINDOW))
+
+		advance_cursor(RESOURCE_ID, MESSAGES, watermark + MAX_WINDOW)
+		self.assertEqual(get_cursor_window(RESOURCE_ID, MESSAGES)[0], watermark + MAX_WINDOW + 1)
+
+	def test_streams_are_independent(self):
+		advance_cursor(RESOURCE_ID, NOTIFICATIONS, NOW - 600)
+
+		self.assertEqual(get_cursor_window(RESOURCE_ID, MESSAGES)[0], NOW - SETTLE_DELAY - INITIAL_LOOKBACK)
+
+	def test_watermark_past_2038(self):
+		watermark = 2 ** 31 + 3600
+		advance_cursor(RESOURCE_ID, NOTIFICATIONS, watermark)
+
+		self.assertEqual(
+			frappe.db.get_value(CURSOR_DOCTYPE, get_cursor_name(RESOURCE_ID, NOTIFICATIONS), "watermark"),
+			watermark
+		)
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Ben and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Wialon Ingestion Cursor", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -1,9 +1,18 @@
 # Copyright (c) 2025, Ben and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class WialonMessage(Document):
 	pass
+
+
+def on_doctype_update():
+	# One row per Wialon message; lets ingestion insert with ignore_duplicates
+	frappe.db.add_unique(
+		"Wialon Message",
+		["message_id", "unit_id", "message_time"],
+		constraint_name="unique_wialon_message"
+	)
@@ -1,9 +1,21 @@
 # Copyright (c) 2025, Ben and Contributors
 # See license.txt
 
-# import frappe
+import os
+import unittest
 from frappe.tests.utils import FrappeTestCase
+from wialon_notifications.api.wialon_cursor import NOTIFICATIONS
+from wialon_notifications.benchmarks.ingestion import BENCHMARK_ENV, run_from_env
 
 
 class TestWialonNotification(FrappeTestCase):
 	pass
+
+
+@unittest.skipUnless(os.environ.get(BENCHMARK_ENV), f"set {BENCHMARK_ENV}=1 to run the ingestion benchmark")
+class TestWialonNotificationIngestionBenchmark(FrappeTestCase):
+	def test_throughput_against_baseline(self):
+		"""process_notifications must not regress past the baseline threshold."""
+		result = run_from_env(NOTIFICATIONS)
+		self.assertEqual(result["inserted"], result["received"] - result["duplicates"])
+		self.assertFalse(result["regressions"], "\n".join(result["regressions"]))
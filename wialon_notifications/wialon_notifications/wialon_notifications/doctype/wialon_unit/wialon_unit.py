@@ -6,4 +6,7 @@ from frappe.model.document import Document
 
 
 class WialonUnit(Document):
-	pass
+	def on_trash(self):
+		from wialon_notifications.api.wialon_notifications import forget_wialon_unit
+
+		forget_wialon_unit(self.name)